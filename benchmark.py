@@ -0,0 +1,277 @@
+import numpy as np
+import pandas as pd
+import os
+import argparse
+import json
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import munge
+
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# Excel caps a sheet at 2**20 rows including the header.
+EXCEL_MAX_ROWS = 1048575
+
+# Resident memory moves by a few MiB with allocator reuse alone, so peak
+# memory only counts as a regression beyond this much on top of the tolerance.
+MEMORY_SLACK_BYTES = 16 * 2 ** 20
+
+PARALLEL_ENTRY_POINT = 'parallel_dashboard_data[workers=%d]'
+
+
+# Value pools for the synthetic catalog. Rule-driven columns draw from the
+# values the rule tables in munge.py test for, plus NaN and an unmatched value,
+# so every branch is exercised at any scale.
+def rule_values(rules, column):
+    return [value for rule_column, op, value, _ in rules if rule_column == column and op == '==']
+
+STUDYTYPE_VALUES = rule_values(munge.STUDYSOP_RULES, 'STUDYTYPE') + ['OBSERVATIONAL', np.nan]
+STUDYSOP_VALUES = rule_values(munge.STUDYSOP_RULES, 'STUDYSOP') + ['CT24', 'CT45', 'CT44', np.nan]
+STUDYSUBTYPE_VALUES = rule_values(munge.STUDYSOP_RULES, 'STUDYSUBTYPE') + ['Other', np.nan]
+PRIMARYDATACOLLECTION_VALUES = rule_values(munge.STUDYSOP_RULES, 'PRIMARYDATACOLLECTION') + ['NO', np.nan]
+SECONDARYDATACOLLECTION_VALUES = rule_values(munge.STUDYSOP_RULES, 'SECONDARYDATACOLLECTION') + ['NO', np.nan]
+EXECUTIONGROUP_VALUES = ([pattern for pattern, _ in munge.EXECUTIONGROUP_REPLACEMENTS]
+                         + rule_values(munge.EXECUTIONGROUP_RULES, 'EXECUTIONGROUP')
+                         + ['ENGINE Team', 'RWE', 'SSR', 'GME', np.nan])
+SPONSORINGDIVISION_VALUES = ['RU', 'GMG', 'PRD', 'Corporate Affairs', 'WRD', 'CONSUMER HEALTHCARE', 'BRDU',
+                             'WRD TECHNOLOGY', 'Oncology', 'Inflammation & Immunology', 'Vaccines', 'Internal Medicine',
+                             'Rare Disease', np.nan]
+STATUS_VALUES = ['Approved', 'approved ', 'Pending', 'ONGOING', ' Completed', 'Cancelled', 'Concept', np.nan]
+INDICATION_VALUES = ['ATTR-CM (Transthyretin Amyloid Cardiomyopathy)', 'Acromegaly', 'Hemophilia',
+                     'Duchenne Muscular Dystrophy', 'Sickle Cell Disease', 'Asthma', 'Breast Cancer', 'Diabetes', np.nan]
+TITLE_FILLER = ['study', 'of', 'patients', 'with', 'real world', 'outcomes', 'registry', 'cohort', 'observational',
+                'treatment', 'safety', 'effectiveness', 'open-label', 'extension']
+# Raw spellings the country resolver rewrites, mixed into the catalog's lists.
+COUNTRY_ALIAS_SPELLINGS = (list(munge.COUNTRY_REPLACEMENTS) + list(munge.COUNTRY_ALIASES) + munge.SERBIA_ALIASES
+                           + munge.UNITED_STATES_FALLBACKS + ['TAIWAN, PROVINCE OF CHINA'])
+DATE_FIELDS = ['COMPLETIONDATE', 'FINALREPORTDATE', 'FSFV', 'LSLV']
+
+
+def country_profile(mapped_data_path):
+    # Study count, countries-per-study and country frequencies observed in
+    # mapped_data.csv.
+    mapped = pd.read_csv(mapped_data_path, usecols=['NAME', 'COUNTRIESOFSTUDY'], dtype=str)
+    per_study = mapped.groupby('NAME').size()
+    fan_out = per_study.value_counts(normalize=True).sort_index()
+    countries = mapped['COUNTRIESOFSTUDY'].value_counts(normalize=True)
+    return len(per_study), fan_out, countries
+
+
+def generate_inputs(out_dir, scale=1, seed=0, alias_rate=0.15,
+                    mapped_data_path=os.path.join(BASE_DIR, 'mapped_data.csv')):
+    # Writes a synthetic EvidenceCatalog.csv, the three harmonization CSVs, the
+    # grants workbook and country_codes.xlsx to out_dir. scale=1 has as many
+    # studies as mapped_data.csv; country fan-out and frequencies follow it,
+    # with alias_rate of the country entries replaced by raw alias spellings.
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    studies, fan_out, country_frequencies = country_profile(mapped_data_path)
+    n = max(int(round(scale * studies)), 1)
+
+    def pick(values, size=n):
+        return np.array(values, dtype=object)[rng.integers(0, len(values), size)]
+
+    names = np.where(rng.random(n) < 0.6,
+                     np.char.add('A', np.char.zfill((np.arange(n) + 1000000).astype(str), 7)),
+                     (np.arange(n) + 50000000).astype(str)).astype(object)
+
+    keyword = pick(munge.CT02_TITLE_KEYWORDS)
+    words = [pick(TITLE_FILLER) for _ in range(4)]
+    titles = words[0] + ' ' + words[1] + ' ' + words[2] + ' ' + words[3]
+    titles = np.where(rng.random(n) < 0.3, keyword + ' ' + titles, titles)
+    titles = np.where(rng.random(n) < 0.02, np.nan, titles)
+
+    lengths = rng.choice(fan_out.index.to_numpy(), size=n, p=fan_out.to_numpy())
+    flat = rng.choice(country_frequencies.index.to_numpy(), size=lengths.sum(), p=country_frequencies.to_numpy())
+    aliased = rng.random(len(flat)) < alias_rate
+    flat[aliased] = pick(COUNTRY_ALIAS_SPELLINGS, aliased.sum())
+    starts = np.cumsum(lengths) - lengths
+    separators = np.where(rng.random(n) < 0.7, '|', ',')
+    countries = [separator.join(flat[start:start + length])
+                 for start, length, separator in zip(starts, lengths, separators)]
+    countries = np.array(countries, dtype=object)
+    countries[rng.random(n) < 0.03] = np.nan
+    in_us = pd.Series(countries).str.contains('UNITED STATES|USA', regex=True, na=False).to_numpy()
+    united_states = np.where(in_us | (rng.random(n) < 0.05), 'Yes', 'No')
+
+    drugs = ['DRUG%03d' % i for i in range(200)]
+    categories = ['CATEGORY%02d' % i for i in range(40)]
+    catalog = pd.DataFrame({
+        'NAME': names,
+        'TITLE': titles,
+        'STUDYTYPE': pick(STUDYTYPE_VALUES),
+        'STUDYSOP': pick(STUDYSOP_VALUES),
+        'STUDYSUBTYPE': pick(STUDYSUBTYPE_VALUES),
+        'PRIMARYDRUG': pick(drugs + ['UNMAPPED DRUG', np.nan]),
+        'CATEGORY': pick(categories + [np.nan]),
+        'PRIMARYDATACOLLECTION': pick(PRIMARYDATACOLLECTION_VALUES),
+        'SECONDARYDATACOLLECTION': pick(SECONDARYDATACOLLECTION_VALUES),
+        'PASS': pick(['yes', 'YES', 'no', 'No', np.nan]),
+        'PMS': pick(['Y', 'N', 'yes', 'no', np.nan]),
+        'INDICATION': pick(INDICATION_VALUES),
+        'EXECUTIONGROUP': pick(EXECUTIONGROUP_VALUES),
+        'STATUS': pick(STATUS_VALUES),
+        'COUNTRIESOFSTUDY': countries,
+        'UNITEDSTATES': united_states,
+        'INTERNATIONALPRIORITY': pick(['Yes', 'No']),
+        'ANCHORMARKET': pick(['Yes', 'No']),
+        'SPONSORINGDIVISION': pick(SPONSORINGDIVISION_VALUES),
+    })
+    dates = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 3650, n), unit='D')
+    for field, populated in zip(DATE_FIELDS, [0.8, 0.4, 0.7, 0.6]):
+        catalog[field] = np.where(rng.random(n) < populated, dates.strftime('%Y-%m-%d'), np.nan)
+    catalog.to_csv(os.path.join(out_dir, 'EvidenceCatalog.csv'), index=False)
+
+    pd.DataFrame({'PRIMARYDRUG': drugs,
+                  'HARMONIZEDPRIMARYDRUG': np.where(rng.random(len(drugs)) < 0.1, 'Not Applicable', drugs),
+                  'DRUGPRIORITY': pick(['High', 'Medium', 'Low'], len(drugs)),
+                  'HARMONIZEDDRUGCATEGORY': pick(['Oncology', 'Rare Disease', 'Vaccines', np.nan], len(drugs))}
+                 ).to_csv(os.path.join(out_dir, 'AssetHarmonization.csv'), index=False)
+    pd.DataFrame({'CATEGORY': categories,
+                  'HARMONIZEDCATEGORY': pick(['Cardiology', 'Neuroscience', 'Immunology', np.nan], len(categories))}
+                 ).to_csv(os.path.join(out_dir, 'CategoryHarmonization.csv'), index=False)
+    pd.DataFrame({'status_native': ['Approved', 'Pending', 'Ongoing', 'Completed', 'Cancelled', 'Concept', 'Unknown'],
+                  'harmonized_status': ['Approved', 'Pending', 'Ongoing', 'Completed', 'Cancelled', 'Pending', 'Unknown'],
+                  'harmonized_status_detail': ['Approved', np.nan, 'Ongoing', 'Completed', 'Cancelled', 'Concept', np.nan]}
+                 ).to_csv(os.path.join(out_dir, 'StatusHarmonization.csv'), index=False)
+
+    grant_ids = names[rng.random(n) < 0.3][:EXCEL_MAX_ROWS]
+    approved = rng.integers(1000, 500000, len(grant_ids)).astype(float)
+    paid = np.round(approved * rng.random(len(grant_ids)))
+    approved[rng.random(len(grant_ids)) < 0.05] = np.nan
+    pd.DataFrame({'GRANT_ID': grant_ids, 'APPROVED_AMOUNT': approved, 'TOTAL_PAID': paid}).to_excel(
+        os.path.join(out_dir, 'Grants Budgets and Payments.xlsx'), sheet_name='Final', index=False)
+    shutil.copy(os.path.join(BASE_DIR, 'country_codes.xlsx'), os.path.join(out_dir, 'country_codes.xlsx'))
+    return n
+
+
+def peak_memory(func, args):
+    # Peak memory growth during func(*args). pandas keeps strings in Arrow
+    # buffers that tracemalloc cannot see, so on Linux the resident set
+    # high-water mark is reset and read back instead; elsewhere tracemalloc is
+    # the fallback and undercounts string columns.
+    if munge.reset_peak_memory():
+        before = munge.resident_memory()[0]
+        func(*args)
+        return munge.resident_memory()[1] - before
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def measure(func, make_args, repeat):
+    # Best wall time over repeat calls, then peak memory over one more.
+    # Arguments are built outside the measured region.
+    seconds = []
+    for _ in range(repeat):
+        args = make_args()
+        started = time.perf_counter()
+        func(*args)
+        seconds.append(time.perf_counter() - started)
+    return min(seconds), peak_memory(func, make_args())
+
+
+def run_benchmarks(data_dir, repeat=3, workers=(1, 2, 4, 8)):
+    # Times the public entry points on the inputs in data_dir, and
+    # parallel_dashboard_data at each of the given worker counts. Returns
+    # {entry point: {rows, seconds, rows_per_sec, peak_memory_bytes}}. Peak
+    # memory of a parallel run is the parent process's only.
+    catalog_rows = len(pd.read_csv(os.path.join(data_dir, 'EvidenceCatalog.csv'), usecols=['NAME']))
+    # Warm-up: builds the Excel sidecar caches, which a real run reuses too.
+    nis = munge.get_dashboard_data(data_dir=data_dir, rename_columns=False)
+    munge.parse_country(data_dir, nis.copy())
+
+    entry_points = {
+        'get_dashboard_data': (munge.get_dashboard_data, lambda: (data_dir,), catalog_rows),
+        'parse_country': (munge.parse_country, lambda: (data_dir, nis.copy()), len(nis)),
+    }
+    for count in workers:
+        entry_points[PARALLEL_ENTRY_POINT % count] = (
+            munge.parallel_dashboard_data, lambda count=count: (data_dir, count), catalog_rows)
+    results = {}
+    for name, (func, make_args, rows) in entry_points.items():
+        seconds, peak = measure(func, make_args, repeat)
+        results[name] = {'rows': rows,
+                         'seconds': seconds,
+                         'rows_per_sec': rows / seconds,
+                         'peak_memory_bytes': peak}
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    # Entry points slower or hungrier than the baseline by more than tolerance.
+    failures = []
+    for name, expected in baseline.items():
+        if name not in results:
+            continue
+        actual = results[name]
+        if actual['rows_per_sec'] < expected['rows_per_sec'] * (1 - tolerance):
+            failures.append('%s: %.0f rows/sec, baseline %.0f' % (name, actual['rows_per_sec'], expected['rows_per_sec']))
+        if actual['peak_memory_bytes'] > expected['peak_memory_bytes'] * (1 + tolerance) + MEMORY_SLACK_BYTES:
+            failures.append('%s: peak memory %d bytes, baseline %d' % (name, actual['peak_memory_bytes'],
+                                                                       expected['peak_memory_bytes']))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the munge entry points on synthetic inputs.')
+    parser.add_argument('--scale', type=float, default=1,
+                        help='catalog size as a multiple of the studies in mapped_data.csv (1 to 100)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per entry point; the best one is reported')
+    parser.add_argument('--data-dir', default=None,
+                        help='keep the generated inputs here and reuse them on later runs')
+    parser.add_argument('--baseline', default=os.path.join(BASE_DIR, 'benchmark_baseline.json'),
+                        help='stored results to compare against, keyed by scale (machine-specific, not tracked)')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed fractional drop in rows/sec or growth in peak memory')
+    parser.add_argument('--workers', type=int, nargs='*', default=[1, 2, 4, 8],
+                        help='worker counts to time parallel_dashboard_data at (none to skip)')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store this run as the baseline for its scale instead of checking it')
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    key = '%g' % args.scale
+    if not args.update_baseline and key not in baselines:
+        raise SystemExit('no baseline for scale %s in %s; record one with --update-baseline' % (key, args.baseline))
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='munge_benchmark_')
+    try:
+        if not os.path.exists(os.path.join(data_dir, 'EvidenceCatalog.csv')):
+            print('generating %d studies in %s' % (generate_inputs(data_dir, args.scale, args.seed), data_dir))
+        results = run_benchmarks(data_dir, args.repeat, args.workers)
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(data_dir)
+
+    for name, result in results.items():
+        print('%-38s %10d rows %8.2fs %12.0f rows/sec %8.1f MiB peak' % (
+            name, result['rows'], result['seconds'], result['rows_per_sec'], result['peak_memory_bytes'] / 2 ** 20))
+    if args.workers:
+        seconds = [results[PARALLEL_ENTRY_POINT % count]['seconds'] for count in args.workers]
+        print('speedup over %d worker(s) on %d CPUs: %s' % (
+            args.workers[0], os.cpu_count(),
+            ', '.join('%d workers %.2fx' % (count, seconds[0] / s) for count, s in zip(args.workers, seconds))))
+
+    if args.update_baseline:
+        baselines[key] = results
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print('baseline for scale %s written to %s' % (key, args.baseline))
+    else:
+        failures = regressions(results, baselines[key], args.tolerance)
+        for failure in failures:
+            print('REGRESSION ' + failure)
+        if failures:
+            raise SystemExit(1)
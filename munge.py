@@ -3,6 +3,24 @@ import numpy as np
 import pandas as pd
 import re
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import inspect
+import itertools
+import json
+import pickle
+import shutil
+import time
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.parquet
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    pyarrow = None
+    CSV_ENGINE = 'c'
 # Step 1: Calculate REMAINING_BUDGET
 def calculate_remaining_budget(row):
     if pd.isna(row['APPROVED_AMOUNT']) or pd.isna(row['TOTAL_PAID']):
@@ -16,91 +34,619 @@ def calculate_remaining_budget(row):
     
 def normalize_str(a_string: str):
     return str(a_string).strip().title()
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_excel_cached(path, sheet_name=0, cache_dir=None):
+    # Parsing xlsx is by far the slowest input path, so each sheet is parsed once
+    # into a pickle sidecar (pickle rather than Parquet/Feather so dtypes come
+    # back exactly as read_excel produced them). The sidecar is reused while the
+    # workbook's size and mtime are unchanged, or while its content hash still
+    # matches after a touch/copy; otherwise the workbook is parsed again.
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), '.cache')
+    sidecar = os.path.join(cache_dir, '{}.{}.pkl'.format(os.path.basename(path), sheet_name))
+    meta_path = sidecar + '.json'
+
+    stat = os.stat(path)
+    meta = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    cached = None
+    if os.path.exists(sidecar) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            cached = json.load(f)
+    if cached is not None and all(cached.get(k) == v for k, v in meta.items()):
+        return pd.read_pickle(sidecar)
+
+    meta['sha256'] = _file_digest(path)
+    if cached is not None and cached.get('sha256') == meta['sha256']:
+        frame = pd.read_pickle(sidecar)
+    else:
+        frame = pd.read_excel(path, sheet_name=sheet_name)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        if cached is None or cached.get('sha256') != meta['sha256']:
+            frame.to_pickle(sidecar + '.tmp')
+            os.replace(sidecar + '.tmp', sidecar)
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+    except OSError:
+        # A read-only input directory just means no sidecar.
+        pass
+    return frame
+
+def _frame_size(frame):
+    if frame is None:
+        return 0, 0
+    return len(frame), int(frame.memory_usage(index=True, deep=True).sum())
+
+
+def resident_memory():
+    # (current, peak) resident set size in bytes, from /proc on Linux; None
+    # where that is not available.
+    status = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                status[key] = value
+    except OSError:
+        return None
+    return int(status['VmRSS'].split()[0]) * 1024, int(status['VmHWM'].split()[0]) * 1024
+
+
+def reset_peak_memory():
+    # Restarts the resident set high-water mark (Linux). Returns False where it
+    # cannot be reset. Resident memory is used rather than tracemalloc, which
+    # slows every allocation and cannot see the Arrow buffers behind pandas str
+    # columns.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+class StageProfiler:
+    # Per-stage wall time, peak resident memory above the stage's starting
+    # point, and input/output row and byte counts. Stages are flat (start/stop
+    # pairs never nest); a stage that runs several times (one call per chunk) is
+    # accumulated under its name. Frame sizes and memory are read outside the
+    # timed region. Peak memory is None where the platform cannot report it. A
+    # disabled profiler does nothing, so the pipeline passes one through
+    # unconditionally.
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}
+        self._current = None
+
+    def start(self, name, frame=None):
+        if not self.enabled:
+            return
+        rows_in, bytes_in = _frame_size(frame)
+        memory_before = resident_memory()[0] if reset_peak_memory() else None
+        self._current = (name, rows_in, bytes_in, memory_before, time.perf_counter())
+
+    def stop(self, frame=None):
+        if not self.enabled:
+            return
+        finished = time.perf_counter()
+        name, rows_in, bytes_in, memory_before, started = self._current
+        peak = resident_memory()[1] - memory_before if memory_before is not None else None
+        rows_out, bytes_out = _frame_size(frame)
+        stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_memory_delta_bytes': None,
+                                              'rows_in': 0, 'rows_out': 0, 'bytes_in': 0, 'bytes_out': 0})
+        stage['calls'] += 1
+        stage['seconds'] += finished - started
+        if peak is not None:
+            stage['peak_memory_delta_bytes'] = max(stage['peak_memory_delta_bytes'] or 0, peak)
+        stage['rows_in'] += rows_in
+        stage['rows_out'] += rows_out
+        stage['bytes_in'] += bytes_in
+        stage['bytes_out'] += bytes_out
+        self._current = None
+
+    def report(self):
+        return {'stages': [dict(stage=name, **values) for name, values in self.stages.items()],
+                'total_seconds': sum(values['seconds'] for values in self.stages.values())}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+NO_PROFILER = StageProfiler(enabled=False)
+
+# TITLE keywords that mark a study as CT02. Matching stays case sensitive, as
+# the listed spellings are the only ones that have ever counted.
+CT02_TITLE_KEYWORDS = ['Phase 1', 'PHASE 1', 'Phase I', 'PHASE I',
+                       'Phase 2', 'PHASE 2', 'Phase II', 'PHASE II',
+                       'Phase 3', 'PHASE 3', 'Phase III', 'PHASE III',
+                       'randomized', 'Randomized', 'RANDOMIZED',
+                       'randomised', 'Randomised', 'RANDOMISED',
+                       'double blind', 'Double Blind', 'DOUBLE BLIND']
+
+# Longest keywords first so the reported keyword is the most specific one
+# ('Phase III' rather than 'Phase I').
+_CT02_TITLE_ALTERNATION = '|'.join(re.escape(k) for k in sorted(CT02_TITLE_KEYWORDS, key=len, reverse=True))
+CT02_TITLE_PATTERN = re.compile('(?:' + _CT02_TITLE_ALTERNATION + ')')
+CT02_TITLE_KEYWORD_PATTERN = re.compile('(' + _CT02_TITLE_ALTERNATION + ')')
+
+def classify_title(titles, return_keyword=False):
+    # Single scan over each title with the combined alternation. Returns the CT02
+    # mask, plus the first matched keyword per row if asked for.
+    if return_keyword:
+        keyword = titles.str.extract(CT02_TITLE_KEYWORD_PATTERN, expand=False)
+        return keyword.notna(), keyword
+    return titles.notna() & titles.str.contains(CT02_TITLE_PATTERN)
+
+# Ordered (column, operator, value, result) rules. Later rules win, exactly like
+# the chain of np.where assignments they replace.
+STUDYSOP_RULES = [
+    ('STUDYSOP', '==', 'GMG', 'GNT01'),
+    ('STUDYSOP', '==', 'CT24; CT34', 'CT24'),
+    ('STUDYSOP', '==', '0', np.nan),
+    ('TITLE', 'classify', classify_title, 'CT02'),
+    ('STUDYTYPE', '==', 'INTERVENTIONAL', 'CT02'),
+    ('STUDYSOP', 'isna', None, 'CT24'),
+    ('PRIMARYDATACOLLECTION', '==', 'YES - CT24, INVOLVES INVESTIGATORS/SITES AND ONLY USES SURVEYS, QUESTIONNAIRES, OR INTERVIEWS', 'CT24'),
+    ('PRIMARYDATACOLLECTION', '==', 'YES - CT24, NO INVESTIGATORS/SITES AND ONLY USES SURVEYS, QUESTIONNAIRES, OR INTERVIEWS', 'CT24'),
+    ('PRIMARYDATACOLLECTION', '==', 'YES - CT24, INVOLVES INVESTIGATORS/SITES AND IS NOT LIMITED TO SURVEYS, QUESTIONNAIRES OR INTERVIEWS', 'CT24'),
+    ('PRIMARYDATACOLLECTION', '==', 'YES - CT24, NO INVESTIGATORS/SITES AND IS NOT LIMITED TO SURVEYS, QUESTIONNAIRES, OR INTERVIEWS', 'CT24'),
+    ('PRIMARYDATACOLLECTION', '==', 'YES - CT24, YES INVESTIGATORS/SITES AND ONLY USES SURVEYS, QUESTIONNAIRES, OR INTERVIEWS', 'CT24'),
+    ('PRIMARYDATACOLLECTION', '==', 'YES - CT45, INVESTIGATORS/SITES', 'CT45'),
+    ('SECONDARYDATACOLLECTION', '==', 'YES - CT24, STRUCTURED DATA ANALYSIS', 'CT24'),
+    ('SECONDARYDATACOLLECTION', '==', 'NO - CT24, PRIMARY DATA COLLECTION STUDY', 'CT24'),
+    ('SECONDARYDATACOLLECTION', '==', 'YES - CT24, HUMAN REVIEW OF UNSTRUCTURED DATA- WITH SITES/INVESTIGATORS', 'CT24'),
+    ('SECONDARYDATACOLLECTION', '==', 'YES - CT24, HUMAN REVIEW OF UNSTRUCTURED DATA- WITHOUT SITES/INVESTIGATORS', 'CT24'),
+    ('STUDYSUBTYPE', '==', 'LOW INTERVENTIONAL STUDY 1', 'CT45'),
+    ('STUDYSUBTYPE', '==', 'LOW INTERVENTIONAL STUDY 2', 'CT45'),
+    ('STUDYSUBTYPE', '==', 'Non-Interventional/Low-Interventional Study Type 1', 'CT45'),
+    ('STUDYSUBTYPE', '==', 'PRAGMATIC CLINICAL TRIAL 2', 'CT45'),
+    ('STUDYTYPE', '==', 'Research Collaboration', 'RC01'),
+    ('STUDYTYPE', '==', 'Investigator Sponsored Research', 'GNT01'),
+    ('STUDYTYPE', '==', 'General Research', 'GNT01'),
+]
+
+STUDYSUBTYPE_RULES = [
+    ('STUDYSUBTYPE', '==', 'LOW INTERVENTIONAL STUDY 1', 'Low Interventional Study 1'),
+    ('STUDYSUBTYPE', '==', 'LOW INTERVENTIONAL STUDY 2', 'Low Interventional Study 2'),
+    ('STUDYSUBTYPE', '==', 'Non-Interventional/Low-Interventional Study Type 1', 'Low Interventional Study 1'),
+    ('STUDYSUBTYPE', '==', 'PRAGMATIC CLINICAL TRIAL 2', 'Low Interventional Study 2'),
+    ('STUDYTYPE', '==', 'Investigator Sponsored Research', 'Investigator Sponsored Research'),
+    ('STUDYTYPE', '==', 'General Research', 'General Research'),
+]
+
+# Substring rewrites applied to EXECUTIONGROUP, in order, before the exact rules.
+EXECUTIONGROUP_REPLACEMENTS = [
+    ('Alliance Partner (SMPA Inc.)', 'Alliance Partner'),
+    ('Center of Excellence', 'RWE'),
+    ('China Medical Affairs', 'Country Medical Affairs'),
+    ('China', 'Country Medical Affairs'),
+    ('Country Med/RWE', 'Country Medical Affairs'),
+    ('Denmark', 'Country Medical Affairs'),
+    ('Finland Medical Affairs', 'Country Medical Affairs'),
+    ('France medical affairs', 'Country Medical Affairs'),
+    ('GMA', 'Medical Affairs'),
+    ('HEOR', 'GAV'),
+    ('PHI', 'GAV'),
+]
+
+EXECUTIONGROUP_RULES = [
+    ('EXECUTIONGROUP', '==', 'Country Medical', 'Country Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'GAV (HV&E)', 'GAV'),
+    ('EXECUTIONGROUP', '==', 'GAV (HV&E) and Medical', 'GAV, Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'GAV co leading with medical', 'GAV, Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'GAV, HVE Primary Care (ELIQUIS)', 'GAV, Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Global Medical', 'Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Israel Medical Affairs', 'Country Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Japan', 'Country Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Japan (Xu, Linghua) from Outcome &Evidence group', 'Country H&V'),
+    ('EXECUTIONGROUP', '==', 'Japan Medical', 'Country Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Japan Medical Team', 'Country Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Korea', 'Country Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Korea/Local PV', 'Korea PMS'),
+    ('EXECUTIONGROUP', '==', 'Legacy Medical', 'Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Local Medical affairs and RWE', 'Country Medical Affairs, Country RWE'),
+    ('EXECUTIONGROUP', '==', 'Local RWE', 'Country RWE'),
+    ('EXECUTIONGROUP', '==', 'Local RWE/Columbia', 'Country RWE'),
+    ('EXECUTIONGROUP', '==', 'MEDICAL AFFAIR', 'Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Medical', 'Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Medical Affairs of Breast Cancer (Owner) but is supported by RWE, Quality, Compliance, and Legal)', 'Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Medical affairs', 'Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'PMS Affairs, Development Japan', 'Japan PMS'),
+    ('EXECUTIONGROUP', '==', 'Polish medical team', 'Country Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'RWE France', 'Country RWE'),
+    ('EXECUTIONGROUP', '==', 'RWE, Korean Post Marketing Surveillance', 'Korea PMS'),
+    ('EXECUTIONGROUP', '==', 'Set up in old structure so being run out of Emerging Market medical group', 'Emerging Markets Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Transferred to Merck', 'Alliance Partner'),
+    ('EXECUTIONGROUP', '==', 'UK', 'Country Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'UK Medical Affairs', 'Country Medical Affairs'),
+    ('EXECUTIONGROUP', '==', 'Unconfirmed', np.nan),
+    ('EXECUTIONGROUP', '==', 'V&E group, study completed', 'GAV'),
+    ('EXECUTIONGROUP', 'contains', 'ENGINE', np.nan),
+]
+
+# apply_pre_filters drops rows holding any of these values.
+EXCLUDED_SPONSORINGDIVISIONS = ['RU', 'GMG', 'PRD', 'Corporate Affairs', 'WRD', 'CONSUMER HEALTHCARE', 'BRDU',
+                                'WRD TECHNOLOGY']
+EXCLUDED_EXECUTIONGROUPS = ['SSR', 'GME']
+EXCLUDED_STUDYSOPS = ['CT02']
+
+def rule_mask(column, op, value):
+    if op == '==':
+        return (column == value).to_numpy(dtype=bool)
+    if op == 'isna':
+        return column.isna().to_numpy(dtype=bool)
+    if op == 'contains':
+        return (column.notna() & column.str.contains(value)).to_numpy(dtype=bool)
+    if op == 'classify':
+        return value(column).to_numpy(dtype=bool)
+    raise ValueError("Unknown rule operator: {}".format(op))
+
+def _joins_batch(batch, rule, target):
+    # Inside a batch every rule reads the values from before the batch. That is
+    # only safe for a rule on the target column itself if no earlier rule in the
+    # batch can hand it a value it would (or would no longer) match.
+    column, op, value, _ = rule
+    if column != target:
+        return True
+    for b_column, b_op, b_value, b_result in batch:
+        if b_column != target or b_op != '==':
+            return False
+        if op == '==':
+            if b_value == value or b_result == value:
+                return False
+        elif op == 'isna':
+            if pd.isna(b_result):
+                return False
+        else:
+            return False
+    return True
+
+def apply_rules(df, target, rules):
+    # Compile the ordered rules into as few np.select passes as the
+    # last-writer-wins semantics allow (np.select takes the first match, so each
+    # batch is evaluated in reverse).
+    values = df[target].to_numpy(dtype=object)
+    batches = [[]]
+    for rule in rules:
+        if batches[-1] and not _joins_batch(batches[-1], rule, target):
+            batches.append([])
+        batches[-1].append(rule)
+
+    for batch in batches:
+        current = pd.Series(values, index=df.index)
+        masks = [rule_mask(current if column == target else df[column], op, value)
+                 for column, op, value, _ in reversed(batch)]
+        results = [result for _, _, _, result in reversed(batch)]
+        values = np.select(masks, results, default=values)
+    return values
+
+def map_unique(series, func, categorical=False):
+    # Run func once over the distinct values of series (NaN included) and
+    # broadcast the results back through the factorized codes, so the string
+    # work is O(unique values) rather than O(rows).
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    mapped = np.asarray(func(pd.Series(uniques)), dtype=object)
+    if categorical:
+        mapped = pd.Categorical(mapped)
+        return pd.Series(pd.Categorical.from_codes(mapped.codes[codes], categories=mapped.categories),
+                         index=series.index)
+    return pd.Series(mapped[codes], index=series.index)
+
+def normalize_countries_of_study(countries):
+    countries = countries.str.title()
+    countries = countries.str.replace('|',',')
+    countries = countries.str.replace('Taiwan, Province Of China','Taiwan')
+    return countries
+
+def normalize_pass(flags):
+    return flags.str.title()
+
+def normalize_pms(flags):
+    flags = flags.str.title()
+    flags = np.where(flags=="N", 'No', flags)
+    flags = np.where(flags=="Y", 'Yes', flags)
+    return flags
+
+def normalize_execution_group(groups):
+    for pattern, replacement in EXECUTIONGROUP_REPLACEMENTS:
+        groups = groups.str.replace(pattern, replacement)
+    return apply_rules(groups.to_frame('EXECUTIONGROUP'), 'EXECUTIONGROUP', EXECUTIONGROUP_RULES)
+
+def normalize_status(statuses):
+    return statuses.fillna('Unknown').apply(lambda x: normalize_str(x))
   
-def parse_country(data_dir, df):
-    # Step 1: Create COUNTRY column and select relevant columns
-    df['COUNTRY'] = df['COUNTRIESOFSTUDY']
-    df = df[["NAME", "COUNTRIESOFSTUDY", "COUNTRY", "UNITEDSTATES", "STATUS", "STUDYSOP"]]
+# Step 3 patterns and their replacements, applied in order.
+COUNTRY_REPLACEMENTS = {
+  r"VENEZUELA, BOLIVARIAN REPUBLIC OF": "VENEZUELA (BOLIVARIAN REPUBLIC OF)",
+  r"KOREA, DEMOCRATIC PEOPLE'S REPUBLIC OF": "KOREA THE DEMOCRATIC PEOPLE'S REPUBLIC OF",
+  r"KOREA, REPUBLIC OF": "KOREA",
+  r"VIRGIN ISLANDS, U.S.": "VIRGIN ISLANDS (U.S.)",
+  r"IRAN, ISLAMIC REPUBLIC OF": "IRAN",
+  r"PALESTINIAN TERRITORY, OCCUPIED": "ISRAEL",
+  r"TANZANIA, UNITED REPUBLIC OF": "TANZANIA",
+  r"ZAIRE": "CONGO DEMOCRATIC",
+  r"CONGO, THE DEMOCRATIC REPUBLIC OF THE": "CONGO DEMOCRATIC",
+  r"THE FORMER YUGOSLAV REPUBLIC OF": "REPUBLIC OF NORTH MACEDONIA",
+  r"MOLDOVA, REPUBLIC OF": "Moldova (THE REPUBLIC OF)"
+  }
 
-    # Step 2: Separate entries by delimiter "|"
-    df = df.assign(COUNTRY=df['COUNTRY'].str.split('|')).explode('COUNTRY')
-    df = df[df['COUNTRY'] != ""].drop_duplicates()
-    df = df.dropna(subset=['COUNTRY'])
-    df['COUNTRY'] = df['COUNTRY'].str.upper()
+# Step 5 aliases for individual country names.
+COUNTRY_ALIASES = {
+    "VIETNAM": "VIET NAM",
+    "SLOVAKIA (SLOVAK REPUBLIC)": "SLOVAKIA",
+    "CROATIA (LOCAL NAME: HRVATSKA)": "CROATIA",
+    "CZECH REPUBLIC": "CZECHIA",
+    "USA": "UNITED STATES",
+    "UK": "UNITED KINGDOM",
+    "SOUTH KOREA": "KOREA",
+    "CHINA": "Province Of China",
+    "MACEDONIA": "Republic of North Macedonia",
+    "CZECHOSLAVAKIA": "Slovakia",
+    "SWAZILAND": "ESWATINI",
+    "BOSNIA AND HERZEGOVINA": "BOSNIA",
+    "NETHERLANDS ANTILLES": "SINT MAARTEN (DUTCH PART)",
+    "GERMAN DEMOCRATIC REPUBLIC": "GERMANY",
+    "USSR": "RUSSIAN FEDERATION",
+}
+SERBIA_ALIASES = ["YUGOSLAVIA", "SERBIA AND MONTENEGRO"]
+# Placeholders that count as the United States when the study says it ran there.
+UNITED_STATES_FALLBACKS = ["UNKNOWN", "CÃ—TE D'IVOIRE", "NA; SINGLE COUNTRY", "EAST EUROPE"]
 
-    # Define the patterns and their replacements
-    replacements = {
-      r"VENEZUELA, BOLIVARIAN REPUBLIC OF": "VENEZUELA (BOLIVARIAN REPUBLIC OF)",
-      r"KOREA, DEMOCRATIC PEOPLE'S REPUBLIC OF": "KOREA THE DEMOCRATIC PEOPLE'S REPUBLIC OF",
-      r"KOREA, REPUBLIC OF": "KOREA",
-      r"VIRGIN ISLANDS, U.S.": "VIRGIN ISLANDS (U.S.)",
-      r"IRAN, ISLAMIC REPUBLIC OF": "IRAN",
-      r"PALESTINIAN TERRITORY, OCCUPIED": "ISRAEL",
-      r"TANZANIA, UNITED REPUBLIC OF": "TANZANIA",
-      r"ZAIRE": "CONGO DEMOCRATIC",
-      r"CONGO, THE DEMOCRATIC REPUBLIC OF THE": "CONGO DEMOCRATIC",
-      r"THE FORMER YUGOSLAV REPUBLIC OF": "REPUBLIC OF NORTH MACEDONIA",
-      r"MOLDOVA, REPUBLIC OF": "Moldova (THE REPUBLIC OF)"
-      }
-    
-    def replace_country_names(column, replacements):
-      for pattern, replacement in replacements.items():
-        column = column.str.replace(pattern, replacement, regex=True)
-      return column
-    
-    df['COUNTRY'] = replace_country_names(df['COUNTRY'], replacements)
 
-    # Step 4: Further split by delimiter "," and clean
-    df = df.assign(COUNTRY=df['COUNTRY'].str.split(',')).explode('COUNTRY')
-    df['COUNTRY'] = df['COUNTRY'].str.strip()
-    df = df[df['COUNTRY'] != ""].drop_duplicates()
-    df = df.dropna(subset=['COUNTRY'])
-    df['COUNTRY'] = df['COUNTRY'].str.upper()
+class CountryResolver:
+    # Resolves a raw COUNTRIESOFSTUDY string (plus whether the study ran in the
+    # United States) to its ordered tuple of country names, memoizing each
+    # distinct pair. The memo can be saved and reloaded between runs; it is
+    # discarded if the tables above or the resolution code have changed since
+    # it was written.
 
-    # Step 5: Replace COUNTRY values based on specific mappings
-    def final_country_mapping(country, united_states):
-        mapping = {
-            "VIETNAM": "VIET NAM",
-            "SLOVAKIA (SLOVAK REPUBLIC)": "SLOVAKIA",
-            "CROATIA (LOCAL NAME: HRVATSKA)": "CROATIA",
-            "CZECH REPUBLIC": "CZECHIA",
-            "USA": "UNITED STATES",
-            "UK": "UNITED KINGDOM",
-            "SOUTH KOREA": "KOREA",
-            "CHINA": "Province Of China",
-            "MACEDONIA": "Republic of North Macedonia",
-            "CZECHOSLAVAKIA": "Slovakia",
-            "SWAZILAND": "ESWATINI",
-            "BOSNIA AND HERZEGOVINA": "BOSNIA",
-            "NETHERLANDS ANTILLES": "SINT MAARTEN (DUTCH PART)",
-            "GERMAN DEMOCRATIC REPUBLIC": "GERMANY",
-            "USSR": "RUSSIAN FEDERATION",
-        }
-        if country in mapping:
-            return mapping[country]
-        if country in ["YUGOSLAVIA", "SERBIA AND MONTENEGRO"]:
+    def __init__(self):
+        self.patterns = [(re.compile(pattern), replacement) for pattern, replacement in COUNTRY_REPLACEMENTS.items()]
+        self.cache = {}
+
+    @classmethod
+    def fingerprint(cls):
+        tables = (COUNTRY_REPLACEMENTS, COUNTRY_ALIASES, SERBIA_ALIASES, UNITED_STATES_FALLBACKS)
+        code = inspect.getsource(cls._resolve) + inspect.getsource(cls._alias)
+        return hashlib.sha1((repr(tables) + code).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def load(cls, path):
+        resolver = cls()
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+            if saved.get('fingerprint') == cls.fingerprint():
+                resolver.cache = saved['cache']
+        return resolver
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump({'fingerprint': self.fingerprint(), 'cache': self.cache}, f)
+
+    def resolve(self, raw, united_states):
+        # Missing values resolve to nothing and stay out of the memo: NaN keys
+        # never compare equal, so every pickled copy would add another entry.
+        if not isinstance(raw, str):
+            return ()
+        key = (raw, united_states)
+        countries = self.cache.get(key)
+        if countries is None:
+            countries = self.cache[key] = self._resolve(raw, united_states)
+        return countries
+
+    def _resolve(self, raw, united_states):
+        if not isinstance(raw, str):
+            return ()
+        countries = []
+        # Step 2: Separate entries by delimiter "|"
+        for entry in raw.split('|'):
+            if entry == "":
+                continue
+            entry = entry.upper()
+            for pattern, replacement in self.patterns:
+                entry = pattern.sub(replacement, entry)
+            # Step 4: Further split by delimiter "," and clean
+            for country in entry.split(','):
+                country = country.strip()
+                if country == "":
+                    continue
+                # Left as the alias table spells it: parse_country removes
+                # duplicates before upper-casing, so "Slovakia" and "SLOVAKIA"
+                # stay two rows.
+                countries.append(self._alias(country.upper(), united_states))
+        return tuple(countries)
+
+    @staticmethod
+    def _alias(country, united_states):
+        # Step 5: Replace COUNTRY values based on specific mappings
+        if country in COUNTRY_ALIASES:
+            return COUNTRY_ALIASES[country]
+        if country in SERBIA_ALIASES:
             return "SERBIA"
-        if country in ["UNKNOWN", "CÃ—TE D'IVOIRE", "NA; SINGLE COUNTRY", "EAST EUROPE"] and united_states == "Yes":
+        if country in UNITED_STATES_FALLBACKS and united_states:
             return "UNITED STATES"
         return country
 
-    df['COUNTRY'] = df.apply(lambda row: final_country_mapping(row['COUNTRY'], row['UNITEDSTATES']), axis=1)
-    
-    # Step 6: Remove duplicates and convert COUNTRY to uppercase
-    df = df.drop_duplicates()
-    df = df.dropna(subset=['COUNTRY'])
-    df['COUNTRY'] = df['COUNTRY'].str.upper()
-    
-    # country_codes = pd.read_excel(os.path.join(data_dir, 'country_codes.xlsx'))
-    country_codes = pd.read_excel("data/input/country_codes.xlsx")
+
+def load_country_codes(data_dir):
+    country_codes = read_excel_cached(os.path.join(data_dir, 'country_codes.xlsx'))
     country_codes.rename(columns = {'Country': 'COUNTRY'}, inplace = True)
     country_codes['COUNTRY'] = country_codes['COUNTRY'].str.upper()
     country_codes['COUNTRY'] = country_codes['COUNTRY'].str.strip()
+    return country_codes
+
+
+def parse_country(data_dir, df, resolver=None, country_codes=None, profiler=NO_PROFILER):
+    if resolver is None:
+        resolver = CountryResolver()
+    if country_codes is None:
+        country_codes = load_country_codes(data_dir)
+    profiler.start('parse_country', df)
+
+    # Step 1: Create COUNTRY column and select relevant columns
+    df['COUNTRY'] = df['COUNTRIESOFSTUDY']
+    df = df[["NAME", "COUNTRIESOFSTUDY", "COUNTRY", "UNITEDSTATES", "STATUS", "STUDYSOP"]]
+
+    # Steps 2-5: Resolve every distinct (COUNTRIESOFSTUDY, UNITEDSTATES) pair once
+    raw_codes, raw_values = pd.factorize(df['COUNTRIESOFSTUDY'], use_na_sentinel=False)
+    in_us = (df['UNITEDSTATES'] == "Yes").to_numpy()
+    pair_codes, pairs = pd.factorize(raw_codes * 2 + in_us)
+    resolved = [resolver.resolve(raw_values[pair // 2], bool(pair % 2)) for pair in pairs]
+
+    # Expand back to one row per (study row, country) with vectorized indexing
+    pair_lengths = np.array([len(countries) for countries in resolved], dtype=np.int64)
+    pair_starts = np.cumsum(pair_lengths) - pair_lengths
+    flat_countries = np.array([country for countries in resolved for country in countries], dtype=object)
+    row_lengths = pair_lengths[pair_codes]
+    row_offsets = np.arange(row_lengths.sum()) - np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths)
+    df = df.take(np.repeat(np.arange(len(df)), row_lengths))
+    df['COUNTRY'] = flat_countries[np.repeat(pair_starts[pair_codes], row_lengths) + row_offsets]
+
+    # Step 6: Remove duplicates and convert COUNTRY to uppercase
+    df = df.drop_duplicates()
+    df['COUNTRY'] = df['COUNTRY'].str.upper()
+
     merged_df = pd.merge(df, country_codes, on='COUNTRY', how='left')
 
+    profiler.stop(merged_df)
     return merged_df
   
 
+# Date fields profiled per STUDYSOP in StudywiseMissingData.csv.
+MISSINGNESS_FIELDS = ['COMPLETIONDATE', 'FINALREPORTDATE', 'FSFV', 'LSLV']
+
+class MissingnessProfile:
+    # Populated and missing counts of date fields per STUDYSOP. add() takes a
+    # frame (or one chunk of it) once the SOP rules have run and folds one
+    # groupby over its null masks into the running counts; merge() folds in
+    # counts built elsewhere, e.g. in a worker process.
+
+    def __init__(self, fields=MISSINGNESS_FIELDS):
+        self.fields = list(fields)
+        self.counts = None
+
+    def add(self, frame):
+        populated = frame[self.fields].notna()
+        populated['Total'] = True
+        self.merge(populated.groupby(frame['STUDYSOP'], dropna=False).sum())
+
+    def merge(self, counts):
+        if counts is None:
+            return
+        if self.counts is not None:
+            counts = self.counts.add(counts, fill_value=0).astype('int64')
+        self.counts = counts
+
+    def report(self):
+        # One row per (STUDYSOP, field), in the layout of StudywiseMissingData.csv.
+        counts = self.counts
+        if counts is None:
+            counts = pd.DataFrame(columns=self.fields + ['Total'], dtype='int64')
+        counts = counts.rename_axis('STUDYSOP').reset_index()
+        report = counts.melt(id_vars=['STUDYSOP', 'Total'], value_vars=self.fields,
+                             var_name='DateField', value_name='PopulatedCount')
+        report = report.sort_values('STUDYSOP', kind='stable', ignore_index=True)
+        report['%Populated'] = report['PopulatedCount'] / report['Total'] * 100
+        report['MissingnessCount'] = report['Total'] - report['PopulatedCount']
+        report['%Missingness'] = report['MissingnessCount'] / report['Total'] * 100
+        return report[['STUDYSOP', 'DateField', 'PopulatedCount', '%Populated', 'MissingnessCount', '%Missingness']]
+
+    def write(self, path):
+        self.report().to_csv(path)
+
+
+# Columns of the nis extract, in output order.
+NIS_COLUMNS = ["NAME",
+               "TITLE",
+               "STUDYTYPE",
+               "STUDYSOP",
+               "STUDYSUBTYPE",
+               "PASS",
+               "PMS",
+               "HARMONIZEDCATEGORY",
+               "INDICATION",
+               "HARMONIZEDPRIMARYDRUG",
+               "DRUGPRIORITY",
+               "STATUS",
+               "STATUSDETAIL",
+               "COUNTRIESOFSTUDY",
+               "UNITEDSTATES",
+               "INTERNATIONALPRIORITY",
+               "ANCHORMARKET",
+               "EXECUTIONGROUP",
+               "SPONSORINGDIVISION",
+               "APPROVED_AMOUNT",
+               "TOTAL_PAID",
+               "REMAINING_BUDGET"]
+
+# Catalog columns the lookup merges join on.
+CATALOG_MERGE_KEYS = ["NAME", "PRIMARYDRUG", "CATEGORY", "STATUS"]
+
+
+def pipeline_columns(missingness=None):
+    # Columns the pipeline reads from the catalog, derived from the rule
+    # tables, the merge keys, the nis extract and any missingness fields.
+    # All of them are text; pinning them to str keeps a chunk that happens to
+    # be all-NaN or all-numeric from changing type. Names that the lookups
+    # supply (HARMONIZEDCATEGORY, ...) are simply absent from the catalog.
+    columns = list(CATALOG_MERGE_KEYS)
+    for rules in (STUDYSOP_RULES, STUDYSUBTYPE_RULES, EXECUTIONGROUP_RULES):
+        columns += [column for column, _, _, _ in rules]
+    columns += NIS_COLUMNS
+    if missingness is not None:
+        columns += missingness.fields
+    return list(dict.fromkeys(columns))
+
+
+def catalog_columns(path, subset_columns=True, missingness=None):
+    # Catalog columns to read, in file order. None means every column, since
+    # without subset_columns they are all carried to the output.
+    if not subset_columns:
+        return None
+    wanted = set(pipeline_columns(missingness))
+    return [column for column in pd.read_csv(path, nrows=0).columns if column in wanted]
+
+
+def read_catalog(path, subset_columns=True, missingness=None):
+    # Reads only the columns the enabled stages need, with the pipeline's
+    # columns pinned to str so nothing is left to type inference. pyarrow
+    # rounds some floats differently from the C parser, so it is only used
+    # when every column read is pinned to str.
+    usecols = catalog_columns(path, subset_columns, missingness)
+    dtype = {column: str for column in pipeline_columns(missingness)}
+    engine = CSV_ENGINE if usecols is not None else 'c'
+    return pd.read_csv(path, index_col=None, usecols=usecols, dtype=dtype, engine=engine)
+
+
+def load_lookups(data_dir,
+                 ah_file='AssetHarmonization.csv',
+                 ch_file='CategoryHarmonization.csv',
+                 sh_file = 'StatusHarmonization.csv',
+                 bp_file = 'Grants Budgets and Payments.xlsx'):
+    # Lookup tables shared by every catalog row.
+    ah = pd.read_csv(os.path.join(data_dir, ah_file))
+    ch = pd.read_csv(os.path.join(data_dir, ch_file))
+    status_ah = pd.read_csv(os.path.join(data_dir, sh_file))
+    grants_bp = read_excel_cached(os.path.join(data_dir,bp_file),sheet_name='Final')
+    grants_bp['REMAINING_BUDGET'] = grants_bp.apply(calculate_remaining_budget, axis=1)
+    #grants_bp.to_csv(os.path.join(data_dir,'GrantsBudgetsPayments.csv'))
+
+    status_ah.status_native = status_ah.status_native.apply(lambda x: normalize_str(x))
+    status_ah.harmonized_status = status_ah.harmonized_status.apply(lambda x: normalize_str(x))
+    status_ah = status_ah[['status_native', 'harmonized_status', 'harmonized_status_detail']].drop_duplicates()
+
+    return {'ah': ah, 'ch': ch, 'status_ah': status_ah, 'grants_bp': grants_bp}
+
+
 def get_dashboard_data(data_dir,
                        ec_file='EvidenceCatalog.csv',
                        ah_file='AssetHarmonization.csv',
@@ -109,83 +655,77 @@ def get_dashboard_data(data_dir,
                        bp_file = 'Grants Budgets and Payments.xlsx',
                        subset_columns=True,
                        rename_columns=True,
-                       apply_pre_filters=True):
+                       apply_pre_filters=True,
+                       categorical=False,
+                       profiler=NO_PROFILER,
+                       missingness=None):
 
     # Load Data.
-    df = pd.read_csv(os.path.join(data_dir, ec_file), index_col=None)
-    ah = pd.read_csv(os.path.join(data_dir, ah_file))
-    ch = pd.read_csv(os.path.join(data_dir, ch_file))
-    status_ah = pd.read_csv(os.path.join(data_dir, sh_file))
-    grants_bp = pd.read_excel(os.path.join(data_dir,bp_file),sheet_name='Final')
-    grants_bp['REMAINING_BUDGET'] = grants_bp.apply(calculate_remaining_budget, axis=1)
-    #grants_bp.to_csv(os.path.join(data_dir,'GrantsBudgetsPayments.csv'))
+    profiler.start('load catalog')
+    df = read_catalog(os.path.join(data_dir, ec_file), subset_columns, missingness=missingness)
+    profiler.stop(df)
+    profiler.start('load lookups')
+    lookups = load_lookups(data_dir, ah_file, ch_file, sh_file, bp_file)
+    profiler.stop()
 
-    status_ah.status_native = status_ah.status_native.apply(lambda x: normalize_str(x))
-    status_ah.harmonized_status = status_ah.harmonized_status.apply(lambda x: normalize_str(x))
-    status_ah = status_ah[['status_native', 'harmonized_status', 'harmonized_status_detail']].drop_duplicates()
+    return harmonize(df, lookups,
+                     subset_columns=subset_columns,
+                     rename_columns=rename_columns,
+                     apply_pre_filters=apply_pre_filters,
+                     categorical=categorical,
+                     profiler=profiler,
+                     missingness=missingness)
 
+
+def harmonize(df, lookups,
+              subset_columns=True,
+              rename_columns=True,
+              apply_pre_filters=True,
+              categorical=False,
+              profiler=NO_PROFILER,
+              missingness=None):
+    # missingness, if given, is a MissingnessProfile that is fed the frame
+    # right after SOP assignment, before any filtering.
+    # Every step below is row-local (left merges and element-wise rewrites), so
+    # harmonizing any subset of catalog rows gives exactly those rows' output.
+    # The same property lets each pre-filter run as soon as the column it tests
+    # has its final value. SPONSORINGDIVISION is filtered first (after the
+    # missingness profile when one is collected, as it counts every study).
+    # The SOP rules only read catalog columns, so they and the STUDYSOP filter
+    # also run before the merges; EXECUTIONGROUP is filtered after its rewrites.
+    ah = lookups['ah']
+    ch = lookups['ch']
+    status_ah = lookups['status_ah']
+    grants_bp = lookups['grants_bp']
+
+    if apply_pre_filters and missingness is None:
+        df = df[~df['SPONSORINGDIVISION'].isin(EXCLUDED_SPONSORINGDIVISIONS)]
+
+    profiler.start('sop rules', df)
+    df = df.assign(STUDYSOP=apply_rules(df, 'STUDYSOP', STUDYSOP_RULES))
+    df = df.assign(STUDYSUBTYPE=apply_rules(df, 'STUDYSUBTYPE', STUDYSUBTYPE_RULES))
+    profiler.stop(df)
+
+    if missingness is not None:
+        profiler.start('missingness profile', df)
+        missingness.add(df)
+        profiler.stop()
+
+    if apply_pre_filters:
+        keep = ~df['STUDYSOP'].isin(EXCLUDED_STUDYSOPS)
+        if missingness is not None:
+            keep &= ~df['SPONSORINGDIVISION'].isin(EXCLUDED_SPONSORINGDIVISIONS)
+        df = df[keep]
+
+    profiler.start('asset and category merge', df)
     harmonizeddrug = pd.merge(df, ah, on="PRIMARYDRUG", how="left")
     harmonizedcategory = pd.merge(harmonizeddrug, ch, on="CATEGORY", how="left")
 
     harmonizedcategory['HARMONIZEDCATEGORY'] = np.where(harmonizedcategory['HARMONIZEDDRUGCATEGORY'].notna(), harmonizedcategory['HARMONIZEDDRUGCATEGORY'], harmonizedcategory['HARMONIZEDCATEGORY'])
+    profiler.stop(harmonizedcategory)
 
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['STUDYSOP']=='GMG', 'GNT01', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['STUDYSOP']=='CT24; CT34', 'CT24', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['STUDYSOP']=='0', np.nan, harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['COUNTRIESOFSTUDY'] = harmonizedcategory['COUNTRIESOFSTUDY'].str.title()
-    harmonizedcategory['COUNTRIESOFSTUDY'] = harmonizedcategory['COUNTRIESOFSTUDY'].str.replace('|',',')
-    harmonizedcategory['COUNTRIESOFSTUDY'] = harmonizedcategory['COUNTRIESOFSTUDY'].str.replace('Taiwan, Province Of China','Taiwan')
-
-
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('Phase 1'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('PHASE 1'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('Phase I'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('PHASE I'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('Phase 2'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('PHASE 2'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('Phase II'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('PHASE II'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('Phase 3'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('PHASE 3'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('Phase III'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('PHASE III'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('randomized'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('Randomized'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('RANDOMIZED'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('randomised'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('Randomised'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('RANDOMISED'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('double blind'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('Double Blind'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['TITLE'].notna() & harmonizedcategory['TITLE'].str.contains('DOUBLE BLIND'), 'CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['STUDYTYPE']=='INTERVENTIONAL','CT02', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['STUDYSOP'].isna(), 'CT24', harmonizedcategory['STUDYSOP'])
-
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['PRIMARYDATACOLLECTION']=='YES - CT24, INVOLVES INVESTIGATORS/SITES AND ONLY USES SURVEYS, QUESTIONNAIRES, OR INTERVIEWS', 'CT24', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['PRIMARYDATACOLLECTION']=='YES - CT24, NO INVESTIGATORS/SITES AND ONLY USES SURVEYS, QUESTIONNAIRES, OR INTERVIEWS', 'CT24', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['PRIMARYDATACOLLECTION']=='YES - CT24, INVOLVES INVESTIGATORS/SITES AND IS NOT LIMITED TO SURVEYS, QUESTIONNAIRES OR INTERVIEWS', 'CT24', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['PRIMARYDATACOLLECTION']=='YES - CT24, NO INVESTIGATORS/SITES AND IS NOT LIMITED TO SURVEYS, QUESTIONNAIRES, OR INTERVIEWS', 'CT24', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['PRIMARYDATACOLLECTION']=='YES - CT24, YES INVESTIGATORS/SITES AND ONLY USES SURVEYS, QUESTIONNAIRES, OR INTERVIEWS', 'CT24', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['PRIMARYDATACOLLECTION']=='YES - CT45, INVESTIGATORS/SITES', 'CT45', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['SECONDARYDATACOLLECTION']=='YES - CT24, STRUCTURED DATA ANALYSIS', 'CT24', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['SECONDARYDATACOLLECTION']=='NO - CT24, PRIMARY DATA COLLECTION STUDY', 'CT24', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['SECONDARYDATACOLLECTION']=='YES - CT24, HUMAN REVIEW OF UNSTRUCTURED DATA- WITH SITES/INVESTIGATORS', 'CT24', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['SECONDARYDATACOLLECTION']=='YES - CT24, HUMAN REVIEW OF UNSTRUCTURED DATA- WITHOUT SITES/INVESTIGATORS', 'CT24', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['STUDYSUBTYPE']=='LOW INTERVENTIONAL STUDY 1', 'CT45', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['STUDYSUBTYPE']=='LOW INTERVENTIONAL STUDY 2', 'CT45', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['STUDYSUBTYPE']=='Non-Interventional/Low-Interventional Study Type 1', 'CT45', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['STUDYSUBTYPE']=='PRAGMATIC CLINICAL TRIAL 2', 'CT45', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['STUDYTYPE']=='Research Collaboration', 'RC01', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['STUDYTYPE']=='Investigator Sponsored Research', 'GNT01', harmonizedcategory['STUDYSOP'])
-    harmonizedcategory['STUDYSOP'] = np.where(harmonizedcategory['STUDYTYPE']=='General Research', 'GNT01', harmonizedcategory['STUDYSOP'])
-
-    harmonizedcategory['STUDYSUBTYPE'] = np.where(harmonizedcategory['STUDYSUBTYPE']=='LOW INTERVENTIONAL STUDY 1', 'Low Interventional Study 1', harmonizedcategory['STUDYSUBTYPE'])
-    harmonizedcategory['STUDYSUBTYPE'] = np.where(harmonizedcategory['STUDYSUBTYPE']=='LOW INTERVENTIONAL STUDY 2', 'Low Interventional Study 2', harmonizedcategory['STUDYSUBTYPE'])
-    harmonizedcategory['STUDYSUBTYPE'] = np.where(harmonizedcategory['STUDYSUBTYPE']=='Non-Interventional/Low-Interventional Study Type 1', 'Low Interventional Study 1', harmonizedcategory['STUDYSUBTYPE'])
-    harmonizedcategory['STUDYSUBTYPE'] = np.where(harmonizedcategory['STUDYSUBTYPE']=='PRAGMATIC CLINICAL TRIAL 2', 'Low Interventional Study 2', harmonizedcategory['STUDYSUBTYPE'])
-    harmonizedcategory['STUDYSUBTYPE'] = np.where(harmonizedcategory['STUDYTYPE']=='Investigator Sponsored Research', 'Investigator Sponsored Research', harmonizedcategory['STUDYSUBTYPE'])
-    harmonizedcategory['STUDYSUBTYPE'] = np.where(harmonizedcategory['STUDYTYPE']=='General Research', 'General Research', harmonizedcategory['STUDYSUBTYPE'])
-
+    profiler.start('column normalization', harmonizedcategory)
+    harmonizedcategory['COUNTRIESOFSTUDY'] = map_unique(harmonizedcategory['COUNTRIESOFSTUDY'], normalize_countries_of_study, categorical)
 
     harmonizedcategory['DRUGPRIORITY'] = np.where(harmonizedcategory['HARMONIZEDPRIMARYDRUG']=='Not Applicable', 'No Drug', harmonizedcategory['DRUGPRIORITY'])
     harmonizedcategory['DRUGPRIORITY'] = np.where(harmonizedcategory['HARMONIZEDPRIMARYDRUG'].isna(), 'No Drug', harmonizedcategory['DRUGPRIORITY'])
@@ -193,10 +733,8 @@ def get_dashboard_data(data_dir,
     # saving original implementation for posterity
     # harmonizedcategory['STATUSDETAIL'] = harmonizedcategory['STATUS']
 
-    harmonizedcategory['PASS'] = harmonizedcategory['PASS'].str.title()
-    harmonizedcategory['PMS'] = harmonizedcategory['PMS'].str.title()
-    harmonizedcategory['PMS'] = np.where(harmonizedcategory['PMS']=="N", 'No', harmonizedcategory['PMS'])
-    harmonizedcategory['PMS'] = np.where(harmonizedcategory['PMS']=="Y", 'Yes', harmonizedcategory['PMS'])
+    harmonizedcategory['PASS'] = map_unique(harmonizedcategory['PASS'], normalize_pass, categorical)
+    harmonizedcategory['PMS'] = map_unique(harmonizedcategory['PMS'], normalize_pms, categorical)
 
     harmonizedcategory['HARMONIZEDCATEGORY'] = np.where(harmonizedcategory['INDICATION']=="ATTR-CM (Transthyretin Amyloid Cardiomyopathy)",'Rare Disease',harmonizedcategory['HARMONIZEDCATEGORY'])
     harmonizedcategory['HARMONIZEDCATEGORY'] = np.where(harmonizedcategory['INDICATION']=="Acromegaly",'Rare Disease',harmonizedcategory['HARMONIZEDCATEGORY'])
@@ -204,54 +742,16 @@ def get_dashboard_data(data_dir,
     harmonizedcategory['HARMONIZEDCATEGORY'] = np.where(harmonizedcategory['INDICATION']=="Duchenne Muscular Dystrophy",'Rare Disease',harmonizedcategory['HARMONIZEDCATEGORY'])
     harmonizedcategory['HARMONIZEDCATEGORY'] = np.where(harmonizedcategory['INDICATION']=="Sickle Cell Disease",'Rare Disease',harmonizedcategory['HARMONIZEDCATEGORY'])
 
-    harmonizedcategory['EXECUTIONGROUP'] = harmonizedcategory['EXECUTIONGROUP'].str.replace('Alliance Partner (SMPA Inc.)','Alliance Partner')
-    harmonizedcategory['EXECUTIONGROUP'] = harmonizedcategory['EXECUTIONGROUP'].str.replace('Center of Excellence','RWE')
-    harmonizedcategory['EXECUTIONGROUP'] = harmonizedcategory['EXECUTIONGROUP'].str.replace('China Medical Affairs','Country Medical Affairs')
-    harmonizedcategory['EXECUTIONGROUP'] = harmonizedcategory['EXECUTIONGROUP'].str.replace('China','Country Medical Affairs')
-    harmonizedcategory['EXECUTIONGROUP'] = harmonizedcategory['EXECUTIONGROUP'].str.replace('Country Med/RWE','Country Medical Affairs')
-    harmonizedcategory['EXECUTIONGROUP'] = harmonizedcategory['EXECUTIONGROUP'].str.replace('Denmark','Country Medical Affairs')
-    harmonizedcategory['EXECUTIONGROUP'] = harmonizedcategory['EXECUTIONGROUP'].str.replace('Finland Medical Affairs','Country Medical Affairs')
-    harmonizedcategory['EXECUTIONGROUP'] = harmonizedcategory['EXECUTIONGROUP'].str.replace('France medical affairs','Country Medical Affairs')
-    harmonizedcategory['EXECUTIONGROUP'] = harmonizedcategory['EXECUTIONGROUP'].str.replace('GMA','Medical Affairs')
-    harmonizedcategory['EXECUTIONGROUP'] = harmonizedcategory['EXECUTIONGROUP'].str.replace('HEOR','GAV')
-    harmonizedcategory['EXECUTIONGROUP'] = harmonizedcategory['EXECUTIONGROUP'].str.replace('PHI','GAV')
-
-
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Country Medical",'Country Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="GAV (HV&E)",'GAV',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="GAV (HV&E) and Medical",'GAV, Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="GAV co leading with medical",'GAV, Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="GAV, HVE Primary Care (ELIQUIS)",'GAV, Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Global Medical",'Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Israel Medical Affairs",'Country Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Japan",'Country Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Japan (Xu, Linghua) from Outcome &Evidence group",'Country H&V',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Japan Medical",'Country Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Japan Medical Team",'Country Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Japan Medical Team",'Country Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Korea",'Country Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Korea/Local PV",'Korea PMS',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Legacy Medical",'Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Local Medical affairs and RWE",'Country Medical Affairs, Country RWE',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Local RWE",'Country RWE',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Local RWE/Columbia",'Country RWE',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Local RWE/Columbia",'Country RWE',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="MEDICAL AFFAIR",'Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Medical",'Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Medical Affairs of Breast Cancer (Owner) but is supported by RWE, Quality, Compliance, and Legal)",'Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Medical affairs",'Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="PMS Affairs, Development Japan",'Japan PMS',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Polish medical team",'Country Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="RWE France",'Country RWE',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="RWE, Korean Post Marketing Surveillance",'Korea PMS',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Set up in old structure so being run out of Emerging Market medical group",'Emerging Markets Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Transferred to Merck",'Alliance Partner',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="UK",'Country Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="UK Medical Affairs",'Country Medical Affairs',harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="Unconfirmed",np.nan,harmonizedcategory['EXECUTIONGROUP'])
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP']=="V&E group, study completed",'GAV',harmonizedcategory['EXECUTIONGROUP'])
-
-    harmonizedcategory['EXECUTIONGROUP'] = np.where(harmonizedcategory['EXECUTIONGROUP'].notna() & harmonizedcategory['EXECUTIONGROUP'].str.contains('ENGINE'), np.nan, harmonizedcategory['EXECUTIONGROUP'])
+    profiler.stop(harmonizedcategory)
+
+    profiler.start('executiongroup rewrites', harmonizedcategory)
+    harmonizedcategory['EXECUTIONGROUP'] = map_unique(harmonizedcategory['EXECUTIONGROUP'], normalize_execution_group, categorical)
+    if apply_pre_filters:
+        harmonizedcategory = harmonizedcategory[~harmonizedcategory['EXECUTIONGROUP'].isin(EXCLUDED_EXECUTIONGROUPS)]
+    profiler.stop(harmonizedcategory)
+
+
+
 
     # saving original implementation for posterity
     # harmonizedcategory['STATUS'] = harmonizedcategory['STATUS'].str.title()
@@ -270,55 +770,24 @@ def get_dashboard_data(data_dir,
     # harmonizedcategory['STATUSDETAIL'] = np.where(harmonizedcategory['STATUSDETAIL'] == "Cancelled", np.nan, harmonizedcategory['STATUSDETAIL'])
     # harmonizedcategory['STATUSDETAIL'] = np.where(harmonizedcategory['STATUSDETAIL'] == "Study Complete", np.nan, harmonizedcategory['STATUSDETAIL'])
 
-    harmonizedcategory['STATUS'] = harmonizedcategory['STATUS'].fillna('Unknown')
-    harmonizedcategory['STATUS'] = harmonizedcategory['STATUS'].apply(lambda x: normalize_str(x))
+    profiler.start('status join', harmonizedcategory)
+    harmonizedcategory['STATUS'] = map_unique(harmonizedcategory['STATUS'], normalize_status)
 
     harmonizedcategory = pd.merge(harmonizedcategory, status_ah, left_on='STATUS', right_on='status_native', how='left')
     harmonizedcategory = harmonizedcategory.drop(['status_native', 'STATUS'], axis=1).rename(columns={'harmonized_status': 'STATUS',
                                                                                                       'harmonized_status_detail': 'STATUSDETAIL'})
+    profiler.stop(harmonizedcategory)
+
+    profiler.start('grants join', harmonizedcategory)
     harmonizedcategory = pd.merge(harmonizedcategory, grants_bp, how='left', left_on='NAME', right_on='GRANT_ID')
     harmonizedcategory = harmonizedcategory.drop(['GRANT_ID'], axis=1)
+    profiler.stop(harmonizedcategory)
 
-
-
-    displayData = harmonizedcategory.copy()
-
-    if apply_pre_filters:
-        displayData = displayData[(displayData['STUDYSOP']!='CT02') 
-                        & (displayData['EXECUTIONGROUP']!='SSR')
-                        & (displayData['EXECUTIONGROUP']!='GME')
-                        & (displayData['SPONSORINGDIVISION']!='RU')
-                        & (displayData['SPONSORINGDIVISION']!='GMG')
-                        & (displayData['SPONSORINGDIVISION']!='PRD')
-                        & (displayData['SPONSORINGDIVISION']!='Corporate Affairs')
-                        & (displayData['SPONSORINGDIVISION']!='WRD')
-                        & (displayData['SPONSORINGDIVISION']!='CONSUMER HEALTHCARE')
-                        & (displayData['SPONSORINGDIVISION']!='BRDU')
-                        & (displayData['SPONSORINGDIVISION']!='WRD TECHNOLOGY')]
+    profiler.start('subset and rename', harmonizedcategory)
+    displayData = harmonizedcategory
 
     if subset_columns:
-        displayData = displayData[["NAME",
-                                   "TITLE",
-                                   "STUDYTYPE",
-                                   "STUDYSOP",
-                                   "STUDYSUBTYPE",
-                                   "PASS",
-                                   "PMS",
-                                   "HARMONIZEDCATEGORY",
-                                   "INDICATION",
-                                   "HARMONIZEDPRIMARYDRUG",
-                                   "DRUGPRIORITY",
-                                   "STATUS",
-                                   "STATUSDETAIL",
-                                   "COUNTRIESOFSTUDY",
-                                   "UNITEDSTATES",
-                                   "INTERNATIONALPRIORITY",
-                                   "ANCHORMARKET",
-                                   "EXECUTIONGROUP",
-                                   "SPONSORINGDIVISION",
-                                   "APPROVED_AMOUNT",
-                                   "TOTAL_PAID",
-                                   "REMAINING_BUDGET"]]
+        displayData = displayData[NIS_COLUMNS]
         
     if rename_columns:
         displayData.rename(columns = {'NAME':'ID',
@@ -345,18 +814,445 @@ def get_dashboard_data(data_dir,
                                       'REMAINING_BUDGET':'Remaining Budget'},
                                       inplace = True)
         
+    profiler.stop(displayData)
     return displayData
+
+
+def _study_boundaries(df):
+    # Row positions where a new NAME starts, plus the NAMEs in catalog order.
+    # Returns None when a NAME is missing or its rows are not contiguous: the
+    # incremental splice, the streamed chunks and the parallel split all rely
+    # on each study being one contiguous block of rows to reproduce the full
+    # run's output.
+    names = df['NAME']
+    if names.isna().any():
+        return None
+    codes, uniques = pd.factorize(names)
+    boundaries = np.flatnonzero(np.diff(codes)) + 1
+    if len(boundaries) + 1 != max(len(uniques), 1):
+        return None
+    return uniques, boundaries
+
+
+def _study_digests(df):
+    # One digest per NAME over the hashes of its catalog rows, in order.
+    studies = _study_boundaries(df)
+    if studies is None:
+        return None
+    uniques, boundaries = studies
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return {name: hashlib.sha1(rows.tobytes()).hexdigest()
+            for name, rows in zip(uniques, np.split(row_hashes, boundaries))}
+
+
+def _splice(kept, fresh, order, template):
+    # Stitch cached and freshly computed rows back into catalog order, then undo
+    # any integer-to-float upcast that only the cached rows' old NaNs caused.
+    frame = pd.concat([kept, fresh], ignore_index=True)
+    frame = frame.iloc[np.argsort(frame['NAME'].map(order).to_numpy(), kind='stable')].reset_index(drop=True)
+    for column, dtype in template.dtypes.items():
+        if (pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype)) \
+                and frame[column].dtype != dtype and frame[column].notna().all():
+            frame[column] = frame[column].astype(dtype)
+    return frame
+
+
+def update_dashboard_data(data_dir, state_path, resolver=None,
+                          ec_file='EvidenceCatalog.csv',
+                          ah_file='AssetHarmonization.csv',
+                          ch_file='CategoryHarmonization.csv',
+                          sh_file = 'StatusHarmonization.csv',
+                          bp_file = 'Grants Budgets and Payments.xlsx',
+                          profiler=NO_PROFILER,
+                          missingness=None):
+    # Incremental version of get_dashboard_data(rename_columns=False) followed
+    # by parse_country. Only studies whose catalog rows were added or changed
+    # since the saved state are harmonized again; removed studies are dropped.
+    # Any change to a lookup file, to the catalog's columns or to this module
+    # forces a full rebuild. Returns (nis, countries), identical to a full run.
+    # Unchanged studies are not harmonized again, so a missingness profile is
+    # taken from the SOP rules applied to the whole catalog instead.
+    profiler.start('load catalog')
+    df = read_catalog(os.path.join(data_dir, ec_file), missingness=missingness)
+    profiler.stop(df)
+    profiler.start('load lookups')
+    lookups = load_lookups(data_dir, ah_file, ch_file, sh_file, bp_file)
+    profiler.stop()
+    if resolver is None:
+        resolver = CountryResolver()
+
+    inputs = {name: _file_digest(os.path.join(data_dir, name))
+              for name in (ah_file, ch_file, sh_file, bp_file, 'country_codes.xlsx')}
+    inputs['munge.py'] = _file_digest(os.path.abspath(__file__))
+    inputs['catalog columns'] = repr([(column, str(dtype)) for column, dtype in df.dtypes.items()])
+    digests = _study_digests(df)
+
+    state = None
+    if os.path.exists(state_path):
+        with open(state_path, 'rb') as f:
+            state = pickle.load(f)
+
+    if digests is None or state is None or state['inputs'] != inputs:
+        nis = harmonize(df, lookups, rename_columns=False, profiler=profiler, missingness=missingness)
+        countries = parse_country(data_dir, nis, resolver=resolver, profiler=profiler)
+    else:
+        if missingness is not None:
+            profiler.start('missingness profile', df)
+            missingness.add(df.assign(STUDYSOP=apply_rules(df, 'STUDYSOP', STUDYSOP_RULES)))
+            profiler.stop()
+        unchanged = [name for name, digest in digests.items() if state['studies'].get(name) == digest]
+        fresh_nis = harmonize(df[~df['NAME'].isin(unchanged)], lookups, rename_columns=False, profiler=profiler)
+        fresh_countries = parse_country(data_dir, fresh_nis, resolver=resolver, profiler=profiler)
+
+        template_nis = harmonize(df.iloc[:0], lookups, rename_columns=False)
+        template_countries = parse_country(data_dir, template_nis, resolver=resolver)
+        profiler.start('splice', fresh_nis)
+        order = pd.Series(np.arange(len(digests)), index=list(digests))
+        nis = _splice(state['nis'][state['nis']['NAME'].isin(unchanged)], fresh_nis, order, template_nis)
+        countries = _splice(state['countries'][state['countries']['NAME'].isin(unchanged)],
+                            fresh_countries, order, template_countries)
+        profiler.stop(nis)
+
+    if digests is not None:
+        with open(state_path, 'wb') as f:
+            pickle.dump({'inputs': inputs, 'studies': digests, 'nis': nis, 'countries': countries}, f)
+    return nis, countries
+
+
+def _float_integer_columns(frame):
+    for column, dtype in frame.dtypes.items():
+        if pd.api.types.is_integer_dtype(dtype):
+            frame[column] = frame[column].astype('float64')
+    return frame
+
+
+def stream_dashboard_outputs(input_dir, output_dir, chunksize=50000, resolver=None,
+                             ec_file='EvidenceCatalog.csv',
+                             ah_file='AssetHarmonization.csv',
+                             ch_file='CategoryHarmonization.csv',
+                             sh_file = 'StatusHarmonization.csv',
+                             bp_file = 'Grants Budgets and Payments.xlsx',
+                             profiler=NO_PROFILER,
+                             missingness=None,
+                             output_format='csv'):
+    # Bounded-memory version of write_dashboard_outputs: the catalog is read
+    # chunksize rows at a time and each chunk is harmonized, run through
+    # parse_country and appended to nis.csv / study_countries.csv (or to the
+    # nis / study_countries Parquet datasets), so only the lookup tables and
+    # one chunk are ever resident. Parquet chunks are appended to staging
+    # datasets, which are rewritten with one file per partition at the end.
+    #
+    # Rows of the study at the end of a chunk are held back for the next one so
+    # parse_country still sees each study whole. That needs each study's rows
+    # to be contiguous, so the NAME column is checked first and a catalog that
+    # fails the check is harmonized in one piece instead. Integer lookup
+    # columns are written as floats in every chunk; a full run does the same
+    # whenever at least one study has no grant or country code.
+    profiler.start('load lookups')
+    lookups = load_lookups(input_dir, ah_file, ch_file, sh_file, bp_file)
+    _float_integer_columns(lookups['grants_bp'])
+    country_codes = _float_integer_columns(load_country_codes(input_dir))
+    profiler.stop()
+    if resolver is None:
+        resolver = CountryResolver()
+
+    if output_format == 'parquet':
+        nis_path = os.path.join(output_dir, 'nis')
+        countries_path = os.path.join(output_dir, 'study_countries')
+        for path in (nis_path, countries_path):
+            shutil.rmtree(path, ignore_errors=True)
+            shutil.rmtree(path + '.chunks', ignore_errors=True)
+    else:
+        nis_path = os.path.join(output_dir, 'nis.csv')
+        countries_path = os.path.join(output_dir, 'study_countries.csv')
+    catalog_path = os.path.join(input_dir, ec_file)
+    usecols = catalog_columns(catalog_path, missingness=missingness)
+    text_dtypes = {column: str for column in usecols}
+    written = {'chunks': 0, 'rows': 0, 'columns': None}
+
+    def write(chunk):
+        nis = harmonize(chunk, lookups, rename_columns=False, profiler=profiler, missingness=missingness)
+        countries = parse_country(input_dir, nis, resolver=resolver, country_codes=country_codes,
+                                  profiler=profiler)
+        first = written['columns'] is None
+        profiler.start('write outputs', nis)
+        if output_format == 'parquet':
+            # Numbered files keep the chunks in catalog order for the rewrite.
+            basename = 'chunk-{:08d}-{{i}}.parquet'.format(written['chunks'])
+            write_partitioned(nis, nis_path + '.chunks', basename_template=basename)
+            write_partitioned(countries, countries_path + '.chunks', basename_template=basename)
+        else:
+            nis.to_csv(nis_path, index=False, mode='w' if first else 'a', header=first)
+            countries.to_csv(countries_path, index=False, mode='w' if first else 'a', header=first)
+        profiler.stop()
+        written['chunks'] += 1
+        written['rows'] += len(nis)
+        written['columns'] = nis.shape[1]
+
+    def finish():
+        if output_format == 'parquet':
+            profiler.start('compact partitions')
+            for path in (nis_path, countries_path):
+                _compact_partitioned(path + '.chunks', path, min_rows_per_group=chunksize)
+                shutil.rmtree(path + '.chunks', ignore_errors=True)
+            profiler.stop()
+        return written['rows'], written['columns']
+
+    profiler.start('check study order')
+    contiguous = _study_boundaries(pd.read_csv(catalog_path, usecols=['NAME'], dtype=str,
+                                               engine=CSV_ENGINE)) is not None
+    profiler.stop()
+    if not contiguous:
+        profiler.start('load catalog')
+        df = pd.read_csv(catalog_path, index_col=None, usecols=usecols, dtype=text_dtypes)
+        profiler.stop(df)
+        write(df)
+        return finish()
+
+    carry = pd.read_csv(catalog_path, index_col=None, nrows=0, usecols=usecols, dtype=text_dtypes)
+    chunks = iter(pd.read_csv(catalog_path, index_col=None, usecols=usecols, chunksize=chunksize,
+                              dtype=text_dtypes))
+    while True:
+        # Each read is its own 'load catalog' call, including the last one,
+        # which finds the end of the file.
+        profiler.start('load catalog')
+        chunk = next(chunks, None)
+        profiler.stop(chunk)
+        if chunk is None:
+            break
+        # A catalog with only a header still yields one empty chunk.
+        if chunk.empty:
+            continue
+        chunk = pd.concat([carry, chunk])
+        names = chunk['NAME'].to_numpy()
+        held = names == names[-1]
+        split = len(names) - np.argmin(held[::-1]) if not held.all() else 0
+        carry = chunk.iloc[split:]
+        if split:
+            write(chunk.iloc[:split])
+    if len(carry) or written['columns'] is None:
+        write(carry)
+    return finish()
+
+
+_WORKER = {}
+
+
+def _init_worker(data_dir, lookups, country_codes, resolver_cache, missingness_fields):
+    # Runs once per pool process, so the lookup tables cross the process
+    # boundary once rather than with every partition.
+    _WORKER['data_dir'] = data_dir
+    _WORKER['lookups'] = lookups
+    _WORKER['country_codes'] = country_codes
+    _WORKER['resolver'] = CountryResolver()
+    _WORKER['resolver'].cache = resolver_cache
+    _WORKER['missingness_fields'] = missingness_fields
+
+
+def _process_partition(df):
+    # Only the memo entries this partition added are sent back; dicts keep
+    # insertion order, so they are the ones after the current end.
+    cache = _WORKER['resolver'].cache
+    known = len(cache)
+    missingness = None
+    if _WORKER['missingness_fields'] is not None:
+        missingness = MissingnessProfile(_WORKER['missingness_fields'])
+    nis = harmonize(df, _WORKER['lookups'], rename_columns=False, missingness=missingness)
+    countries = parse_country(_WORKER['data_dir'], nis, resolver=_WORKER['resolver'],
+                              country_codes=_WORKER['country_codes'])
+    added = dict(itertools.islice(cache.items(), known, None))
+    return nis, countries, added, missingness and missingness.counts
+
+
+def parallel_dashboard_data(data_dir, workers, resolver=None,
+                            ec_file='EvidenceCatalog.csv',
+                            ah_file='AssetHarmonization.csv',
+                            ch_file='CategoryHarmonization.csv',
+                            sh_file = 'StatusHarmonization.csv',
+                            bp_file = 'Grants Budgets and Payments.xlsx',
+                            profiler=NO_PROFILER,
+                            missingness=None):
+    # Multi-process version of get_dashboard_data(rename_columns=False)
+    # followed by parse_country. The catalog is cut into one block of whole
+    # studies per worker, the blocks are harmonized in a process pool and the
+    # results are concatenated back in catalog order, which is exactly the
+    # serial output. Falls back to the serial path when studies are not
+    # contiguous. Returns (nis, countries).
+    profiler.start('load catalog')
+    df = read_catalog(os.path.join(data_dir, ec_file), missingness=missingness)
+    profiler.stop(df)
+    profiler.start('load lookups')
+    lookups = load_lookups(data_dir, ah_file, ch_file, sh_file, bp_file)
+    country_codes = load_country_codes(data_dir)
+    profiler.stop()
+    if resolver is None:
+        resolver = CountryResolver()
+
+    studies = _study_boundaries(df)
+    if workers <= 1 or studies is None:
+        nis = harmonize(df, lookups, rename_columns=False, profiler=profiler, missingness=missingness)
+        countries = parse_country(data_dir, nis, resolver=resolver, country_codes=country_codes,
+                                  profiler=profiler)
+        return nis, countries
+
+    starts = np.concatenate([[0], studies[1]])
+    targets = np.arange(1, workers) * len(df) // workers
+    cuts = np.unique(starts[np.minimum(np.searchsorted(starts, targets), len(starts) - 1)])
+    cuts = [0] + [int(cut) for cut in cuts if 0 < cut < len(df)] + [len(df)]
+    partitions = [df.iloc[lo:hi] for lo, hi in zip(cuts[:-1], cuts[1:])]
+
+    # Worker stages run in other processes; only the whole fan-out is timed here.
+    profiler.start('parallel harmonize', df)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(data_dir, lookups, country_codes, resolver.cache,
+                                       missingness and missingness.fields)) as pool:
+        results = list(pool.map(_process_partition, partitions))
+    for _, _, cache, counts in results:
+        resolver.cache.update(cache)
+        if missingness is not None:
+            missingness.merge(counts)
+    nis = pd.concat([result[0] for result in results], ignore_index=True)
+    countries = pd.concat([result[1] for result in results], ignore_index=True)
+    profiler.stop(nis)
+    return nis, countries
+
+
+# Columns the Parquet extracts are partitioned by, outermost directory first.
+PARTITION_COLUMNS = ['STUDYSOP', 'STATUS']
+
+def write_partitioned(frame, path, partition_cols=PARTITION_COLUMNS, basename_template=None):
+    # Appends frame to the hive-partitioned Parquet dataset at path, one
+    # directory level per partition column. Other string columns are stored as
+    # dictionaries, so each distinct NAME, country or code is kept once per
+    # file and reads back as a Categorical. basename_template names the new
+    # files as in pyarrow (random names by default).
+    if pyarrow is None:
+        raise ImportError('writing Parquet extracts requires pyarrow')
+    table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if field.name not in partition_cols and (pyarrow.types.is_string(field.type)
+                                                 or pyarrow.types.is_large_string(field.type)):
+            encoded = pyarrow.compute.dictionary_encode(table.column(i))
+            table = table.set_column(i, field.name, encoded.cast(pyarrow.dictionary(pyarrow.int32(), pyarrow.string())))
+    pyarrow.parquet.write_to_dataset(table, path, partition_cols=list(partition_cols),
+                                     basename_template=basename_template)
+
+
+def _compact_partitioned(source, path, partition_cols=PARTITION_COLUMNS, min_rows_per_group=0):
+    # Rewrites a dataset that write_partitioned appended to chunk by chunk as
+    # one file per partition. Record batches are streamed through, and each
+    # partition buffers at most min_rows_per_group rows before writing a row
+    # group; without it every small chunk becomes its own row group, which
+    # makes full reads ten times slower. A column that was all missing in
+    # some chunks is given the type the other chunks stored it with.
+    if not os.path.exists(source):
+        return
+    fragments = pyarrow.dataset.dataset(source, format='parquet', partitioning='hive')
+    partitions = pyarrow.schema([fragments.schema.field(column) for column in partition_cols])
+    schema = pyarrow.unify_schemas([fragment.physical_schema for fragment in fragments.get_fragments()]
+                                   + [partitions])
+    dataset = pyarrow.dataset.dataset(source, schema=schema, format='parquet',
+                                      partitioning=pyarrow.dataset.partitioning(partitions, flavor='hive'))
+    pyarrow.dataset.write_dataset(dataset, path, format='parquet', preserve_order=True,
+                                  partitioning=pyarrow.dataset.partitioning(partitions, flavor='hive'),
+                                  min_rows_per_group=min_rows_per_group)
+
+
+def read_partitioned(path, columns=None, **partitions):
+    # Reads the dataset written by write_partitioned, loading only the given
+    # columns and only the partition directories that match, e.g.
+    # read_partitioned(path, ['NAME', 'COUNTRY'], STUDYSOP='CT24',
+    # STATUS=['Ongoing', 'Completed']). Partition columns come back last.
+    if pyarrow is None:
+        raise ImportError('reading Parquet extracts requires pyarrow')
+    dataset = pyarrow.dataset.dataset(path, format='parquet', partitioning='hive')
+    condition = None
+    for column, values in partitions.items():
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        clause = pyarrow.dataset.field(column).isin(list(values))
+        condition = clause if condition is None else condition & clause
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+def write_dashboard_outputs(input_dir, output_dir, incremental=False, chunksize=None, workers=1, profile=False,
+                            missingness_fields=None, output_format='csv'):
+    # With profile=True a per-stage report (time, peak memory, rows and bytes
+    # in/out) is written to munge_profile.json next to the extracts. With a
+    # list of missingness_fields, their per-STUDYSOP missingness is written to
+    # StudywiseMissingData.csv. output_format='parquet' writes the extracts as
+    # the nis / study_countries datasets (see write_partitioned) instead of CSV.
+    # Returns the shape of the nis extract.
+    profiler = StageProfiler() if profile else NO_PROFILER
+    missingness = MissingnessProfile(missingness_fields) if missingness_fields is not None else None
+    missingness_path = os.path.join(output_dir, 'StudywiseMissingData.csv')
+    profile_path = os.path.join(output_dir, 'munge_profile.json')
+    resolver_cache = os.path.join(output_dir, 'country_resolver.pkl')
+    resolver = CountryResolver.load(resolver_cache)
+    if chunksize:
+        shape = stream_dashboard_outputs(input_dir, output_dir, chunksize=chunksize, resolver=resolver,
+                                         profiler=profiler, missingness=missingness, output_format=output_format)
+        resolver.save(resolver_cache)
+        if missingness is not None:
+            missingness.write(missingness_path)
+        if profile:
+            profiler.write(profile_path)
+        return shape
+    if incremental:
+        nis, countries = update_dashboard_data(input_dir, os.path.join(output_dir, 'incremental_state.pkl'),
+                                               resolver=resolver, profiler=profiler, missingness=missingness)
+    elif workers > 1:
+        nis, countries = parallel_dashboard_data(input_dir, workers, resolver=resolver, profiler=profiler,
+                                                 missingness=missingness)
+    else:
+        nis = get_dashboard_data(data_dir=input_dir, rename_columns=False, profiler=profiler,
+                                 missingness=missingness)
+        countries = parse_country(input_dir, nis, resolver=resolver, profiler=profiler)
+    resolver.save(resolver_cache)
+    profiler.start('write outputs', nis)
+    if output_format == 'parquet':
+        for name, frame in (('nis', nis), ('study_countries', countries)):
+            shutil.rmtree(os.path.join(output_dir, name), ignore_errors=True)
+            write_partitioned(frame, os.path.join(output_dir, name))
+    else:
+        nis.to_csv(os.path.join(output_dir, 'nis.csv'), index=False)
+        countries.to_csv(os.path.join(output_dir, 'study_countries.csv'), index=False)
+    if missingness is not None:
+        missingness.write(missingness_path)
+    profiler.stop()
+    if profile:
+        profiler.write(profile_path)
+    return nis.shape
   
   
   
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the NIS dashboard extracts.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only re-harmonize studies changed since the last incremental run')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='stream the catalog in chunks of this many rows to bound memory')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='harmonize the catalog in this many processes')
+    parser.add_argument('--profile', action='store_true',
+                        help='write a per-stage time/memory report to munge_profile.json')
+    parser.add_argument('--missingness', nargs='*', metavar='FIELD', default=None,
+                        help='write per-STUDYSOP missingness of these date fields (default: %s) '
+                             'to StudywiseMissingData.csv' % ', '.join(MISSINGNESS_FIELDS))
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                        help='write the extracts as CSV files or as Parquet datasets partitioned by %s'
+                             % ' and '.join(PARTITION_COLUMNS))
+    args = parser.parse_args()
+
     base_dir = os.path.dirname(os.path.realpath(__file__))
     data_dir = os.path.join(base_dir, '..', 'data')
     input_dir = os.path.join(data_dir, 'input')
     output_dir = os.path.join(data_dir, 'output')
-    nis = get_dashboard_data(data_dir=input_dir, rename_columns=False)
-    countries = parse_country(data_dir=input_dir, nis)
-    print(nis.shape)
-    print(os.path.join(output_dir, 'nis.csv'))
-    nis.to_csv(os.path.join(output_dir, 'nis.csv'), index=False)
-    countries.to_csv(os.path.join(output_dir, 'study_countries.csv'), index=False)
+    missingness_fields = args.missingness
+    if missingness_fields == []:
+        missingness_fields = MISSINGNESS_FIELDS
+    shape = write_dashboard_outputs(input_dir, output_dir, incremental=args.incremental, chunksize=args.chunksize,
+                                    workers=args.workers, profile=args.profile, missingness_fields=missingness_fields,
+                                    output_format=args.format)
+    print(shape)
+    print(os.path.join(output_dir, 'nis' if args.format == 'parquet' else 'nis.csv'))
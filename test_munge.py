@@ -0,0 +1,375 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmark
+import munge
+
+
+EXPECTED_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_data')
+
+# The expected_*.csv files were written by the original munge.py (the chain of
+# np.where rules, before any of the rewrites) from these generated inputs.
+SCALE = 0.02
+SEED = 0
+
+
+@pytest.fixture(scope='module')
+def input_dir(tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp('input'))
+    benchmark.generate_inputs(data_dir, SCALE, SEED)
+    return data_dir
+
+
+def expected(name):
+    with open(os.path.join(EXPECTED_DIR, name)) as f:
+        return f.read()
+
+
+def as_csv(frame):
+    return frame.to_csv(index=False)
+
+
+def read_outputs(output_dir):
+    outputs = {}
+    for name in ('nis.csv', 'study_countries.csv', 'StudywiseMissingData.csv'):
+        with open(os.path.join(output_dir, name)) as f:
+            outputs[name] = f.read()
+    return outputs
+
+
+def build(input_dir, output_dir, **options):
+    os.makedirs(output_dir, exist_ok=True)
+    munge.write_dashboard_outputs(input_dir, output_dir, missingness_fields=munge.MISSINGNESS_FIELDS, **options)
+    return read_outputs(output_dir)
+
+
+def test_get_dashboard_data_matches_original(input_dir):
+    assert as_csv(munge.get_dashboard_data(input_dir)) == expected('expected_dashboard.csv')
+    assert as_csv(munge.get_dashboard_data(input_dir, rename_columns=False)) == expected('expected_nis.csv')
+    unfiltered = munge.get_dashboard_data(input_dir, apply_pre_filters=False, subset_columns=False)
+    assert as_csv(unfiltered) == expected('expected_unfiltered.csv')
+
+
+def apply_rules_one_by_one(df, target, rules):
+    values = df[target].to_numpy(dtype=object)
+    for column, op, value, result in rules:
+        current = pd.Series(values, index=df.index)
+        values = np.where(munge.rule_mask(current if column == target else df[column], op, value), result, values)
+    return values
+
+
+@pytest.mark.parametrize('target, rules', [('STUDYSOP', munge.STUDYSOP_RULES),
+                                           ('STUDYSUBTYPE', munge.STUDYSUBTYPE_RULES),
+                                           ('EXECUTIONGROUP', munge.EXECUTIONGROUP_RULES)])
+def test_batched_rules_match_rules_applied_in_order(input_dir, target, rules):
+    catalog = munge.read_catalog(os.path.join(input_dir, 'EvidenceCatalog.csv'))
+    pd.testing.assert_series_equal(pd.Series(munge.apply_rules(catalog, target, rules)),
+                                   pd.Series(apply_rules_one_by_one(catalog, target, rules)))
+
+
+def test_categorical_output_matches_original(input_dir):
+    nis = munge.get_dashboard_data(input_dir, rename_columns=False, categorical=True)
+    categorical = [column for column in nis.columns if isinstance(nis[column].dtype, pd.CategoricalDtype)]
+    assert categorical == ['PASS', 'PMS', 'COUNTRIESOFSTUDY', 'EXECUTIONGROUP']
+    assert as_csv(nis.astype({column: 'str' for column in categorical})) == expected('expected_nis.csv')
+
+
+@pytest.mark.parametrize('categorical', [False, True])
+def test_map_unique_matches_normalizing_every_row(categorical):
+    flags = pd.Series(['yes', 'NO', np.nan, 'yes', 'No', np.nan, 'YES'], index=range(10, 17))
+    mapped = munge.map_unique(flags, munge.normalize_pass, categorical)
+    assert mapped.index.equals(flags.index)
+    assert isinstance(mapped.dtype, pd.CategoricalDtype) == categorical
+    pd.testing.assert_series_equal(mapped.astype(object), munge.normalize_pass(flags).astype(object))
+
+
+def test_parse_country_matches_original(input_dir):
+    nis = munge.get_dashboard_data(input_dir, rename_columns=False)
+    assert as_csv(munge.parse_country(input_dir, nis)) == expected('expected_study_countries.csv')
+
+
+def test_country_aliases_keep_original_duplicates():
+    # "Slovakia" (from CZECHOSLAVAKIA) and "SLOVAKIA" only become equal after
+    # the final upper-casing, so the original output keeps both rows.
+    df = pd.DataFrame({'NAME': ['S1'], 'COUNTRIESOFSTUDY': ['CZECHOSLAVAKIA|SLOVAKIA|Slovakia'],
+                       'UNITEDSTATES': ['No'], 'STATUS': ['Ongoing'], 'STUDYSOP': ['CT24']})
+    codes = pd.DataFrame({'COUNTRY': ['SLOVAKIA'], 'Alpha-2 code': ['SK'], 'Alpha-3 code': ['SVK'],
+                          'Numeric': [703.0]})
+    countries = munge.parse_country(None, df, country_codes=codes)
+    assert countries['COUNTRY'].tolist() == ['SLOVAKIA', 'SLOVAKIA']
+    assert np.all(countries['Alpha-2 code'] == 'SK')
+
+
+def test_resolver_memo_survives_save_until_the_tables_change(tmp_path, monkeypatch):
+    path = str(tmp_path / 'country_resolver.pkl')
+    resolver = munge.CountryResolver()
+    assert resolver.resolve('USA|Czechoslavakia', False) == resolver._resolve('USA|Czechoslavakia', False)
+    assert resolver.resolve(np.nan, False) == ()
+    resolver.save(path)
+    assert munge.CountryResolver.load(path).cache == {('USA|Czechoslavakia', False): ('UNITED STATES', 'Slovakia')}
+
+    monkeypatch.setitem(munge.COUNTRY_ALIASES, 'USA', 'UNITED STATES OF AMERICA')
+    assert munge.CountryResolver.load(path).cache == {}
+
+
+@pytest.fixture
+def excel_reads(monkeypatch):
+    reads = []
+    read_excel = pd.read_excel
+
+    def counting_read_excel(path, **kwargs):
+        reads.append(path)
+        return read_excel(path, **kwargs)
+
+    monkeypatch.setattr(pd, 'read_excel', counting_read_excel)
+    return reads
+
+
+def test_excel_sidecar_is_reused_until_the_workbook_changes(tmp_path, excel_reads):
+    path = str(tmp_path / 'grants.xlsx')
+    pd.DataFrame({'GRANT_ID': ['A1', 'A2'], 'TOTAL_PAID': [1.0, 2.0]}).to_excel(path, sheet_name='Final', index=False)
+    first = munge.read_excel_cached(path, sheet_name='Final')
+    assert len(excel_reads) == 1
+
+    # Same size and mtime: the sidecar is used without hashing the workbook.
+    pd.testing.assert_frame_equal(munge.read_excel_cached(path, sheet_name='Final'), first)
+    # Touched but unchanged: the content hash still matches.
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+    pd.testing.assert_frame_equal(munge.read_excel_cached(path, sheet_name='Final'), first)
+    assert len(excel_reads) == 1
+
+    mtime_ns = os.stat(path).st_mtime_ns
+    pd.DataFrame({'GRANT_ID': ['A1', 'A3'], 'TOTAL_PAID': [1.0, 5.0]}).to_excel(path, sheet_name='Final', index=False)
+    os.utime(path, ns=(mtime_ns + 10 ** 9, mtime_ns + 10 ** 9))
+    assert munge.read_excel_cached(path, sheet_name='Final')['GRANT_ID'].tolist() == ['A1', 'A3']
+    assert munge.read_excel_cached(path, sheet_name='Final')['TOTAL_PAID'].tolist() == [1.0, 5.0]
+    assert len(excel_reads) == 2
+
+
+def test_excel_without_a_writable_cache_is_parsed_every_time(tmp_path, excel_reads):
+    path = str(tmp_path / 'country_codes.xlsx')
+    pd.DataFrame({'Country': ['Slovakia'], 'Numeric': [703]}).to_excel(path, index=False)
+    blocked = tmp_path / 'blocked'
+    blocked.write_text('')
+    for _ in range(2):
+        frame = munge.read_excel_cached(path, cache_dir=str(blocked / '.cache'))
+        assert frame['Country'].tolist() == ['Slovakia']
+    assert len(excel_reads) == 2
+
+
+def split_studies(input_dir, data_dir, rows=40):
+    # Copies the inputs with the first rows of the catalog repeated at its
+    # end, so those studies' rows are no longer contiguous.
+    shutil.copytree(input_dir, data_dir)
+    catalog_path = os.path.join(data_dir, 'EvidenceCatalog.csv')
+    catalog = pd.read_csv(catalog_path, dtype=str)
+    pd.concat([catalog, catalog.iloc[:rows]], ignore_index=True).to_csv(catalog_path, index=False)
+    return data_dir
+
+
+def test_incremental_matches_full_run(input_dir, tmp_path):
+    full = build(input_dir, str(tmp_path / 'full'))
+    assert build(input_dir, str(tmp_path / 'incremental'), incremental=True) == full
+    # The second run reuses every study from the saved state.
+    assert build(input_dir, str(tmp_path / 'incremental'), incremental=True) == full
+
+
+def test_incremental_follows_catalog_edits(input_dir, tmp_path):
+    data_dir = str(tmp_path / 'input')
+    shutil.copytree(input_dir, data_dir)
+    build(data_dir, str(tmp_path / 'incremental'), incremental=True)
+
+    catalog_path = os.path.join(data_dir, 'EvidenceCatalog.csv')
+    catalog = pd.read_csv(catalog_path, dtype=str)
+    catalog.loc[3, 'STUDYSOP'] = 'GMG'
+    catalog.loc[5, 'COUNTRIESOFSTUDY'] = 'USA|CZECHOSLAVAKIA,SLOVAKIA'
+    inserted = catalog.iloc[[7]].assign(NAME='A9999999')
+    catalog = pd.concat([catalog.drop(index=[10, 11]), inserted], ignore_index=True)
+    catalog.to_csv(catalog_path, index=False)
+
+    incremental = build(data_dir, str(tmp_path / 'incremental'), incremental=True)
+    assert incremental == build(data_dir, str(tmp_path / 'full'))
+
+
+def test_incremental_rebuilds_split_studies_in_full(input_dir, tmp_path):
+    data_dir = split_studies(input_dir, str(tmp_path / 'input'))
+    full = build(data_dir, str(tmp_path / 'full'))
+    assert build(data_dir, str(tmp_path / 'incremental'), incremental=True) == full
+    assert build(data_dir, str(tmp_path / 'incremental'), incremental=True) == full
+
+
+@pytest.mark.parametrize('chunksize', [97, 50000])
+def test_streaming_matches_full_run(input_dir, tmp_path, chunksize):
+    full = build(input_dir, str(tmp_path / 'full'))
+    assert build(input_dir, str(tmp_path / 'streamed'), chunksize=chunksize) == full
+
+
+def test_streaming_keeps_split_studies_whole(input_dir, tmp_path):
+    data_dir = split_studies(input_dir, str(tmp_path / 'input'))
+    full = build(data_dir, str(tmp_path / 'full'))
+    assert build(data_dir, str(tmp_path / 'streamed'), chunksize=50) == full
+
+
+@pytest.mark.parametrize('options', [{}, {'chunksize': 50}, {'workers': 3}, {'incremental': True}])
+def test_empty_catalog_gives_empty_extracts(input_dir, tmp_path, options):
+    data_dir = str(tmp_path / 'input')
+    shutil.copytree(input_dir, data_dir)
+    catalog_path = os.path.join(data_dir, 'EvidenceCatalog.csv')
+    pd.read_csv(catalog_path, nrows=0).to_csv(catalog_path, index=False)
+    output_dir = str(tmp_path / 'output')
+    os.makedirs(output_dir)
+    shape = munge.write_dashboard_outputs(data_dir, output_dir, **options)
+    # parse_country adds COUNTRY to the nis frame it is given.
+    assert shape == (0, len(munge.NIS_COLUMNS) + 1)
+    assert pd.read_csv(os.path.join(output_dir, 'nis.csv')).shape == shape
+
+
+def resolver_memo(output_dir):
+    return munge.CountryResolver.load(os.path.join(output_dir, 'country_resolver.pkl')).cache
+
+
+def test_workers_match_full_run(input_dir, tmp_path):
+    full = build(input_dir, str(tmp_path / 'full'))
+    assert build(input_dir, str(tmp_path / 'workers'), workers=3) == full
+    assert resolver_memo(str(tmp_path / 'workers')) == resolver_memo(str(tmp_path / 'full'))
+
+
+def test_workers_run_split_studies_serially(input_dir, tmp_path):
+    data_dir = split_studies(input_dir, str(tmp_path / 'input'))
+    full = build(data_dir, str(tmp_path / 'full'))
+    assert build(data_dir, str(tmp_path / 'workers'), workers=3) == full
+
+
+HARMONIZE_STAGES = ['sop rules', 'asset and category merge', 'column normalization', 'executiongroup rewrites',
+                    'status join', 'grants join', 'subset and rename', 'parse_country']
+
+
+def read_profile(output_dir):
+    with open(os.path.join(output_dir, 'munge_profile.json')) as f:
+        return {stage.pop('stage'): stage for stage in json.load(f)['stages']}
+
+
+@pytest.mark.parametrize('chunksize', [None, 97])
+def test_profile_reports_every_stage(input_dir, tmp_path, chunksize):
+    output_dir = str(tmp_path / 'output')
+    os.makedirs(output_dir)
+    munge.write_dashboard_outputs(input_dir, output_dir, chunksize=chunksize, profile=True)
+    stages = read_profile(output_dir)
+    catalog_rows = len(pd.read_csv(os.path.join(input_dir, 'EvidenceCatalog.csv'), usecols=['NAME']))
+    assert stages['load catalog']['rows_out'] == catalog_rows
+    if chunksize is None:
+        assert list(stages) == ['load catalog', 'load lookups'] + HARMONIZE_STAGES + ['write outputs']
+        assert all(stage['calls'] == 1 for stage in stages.values())
+    else:
+        assert list(stages) == ['load lookups', 'check study order', 'load catalog'] + HARMONIZE_STAGES + ['write outputs']
+        # One read per chunk plus the one that finds the end of the file.
+        assert stages['load catalog']['calls'] == -(-catalog_rows // chunksize) + 1
+        assert stages['write outputs']['calls'] == stages['sop rules']['calls']
+    assert all(stage['seconds'] >= 0 for stage in stages.values())
+
+
+def test_disabled_profiler_records_nothing(input_dir, tmp_path):
+    output_dir = str(tmp_path / 'output')
+    os.makedirs(output_dir)
+    munge.write_dashboard_outputs(input_dir, output_dir, chunksize=97)
+    assert not os.path.exists(os.path.join(output_dir, 'munge_profile.json'))
+    assert munge.NO_PROFILER.stages == {}
+
+    profiler = munge.StageProfiler(enabled=False)
+    profiler.start('load catalog')
+    profiler.stop(pd.DataFrame({'NAME': ['A1']}))
+    assert profiler.report() == {'stages': [], 'total_seconds': 0}
+
+
+def test_missingness_counts_every_study(input_dir):
+    profile = munge.MissingnessProfile()
+    munge.get_dashboard_data(input_dir, missingness=profile)
+    report = profile.report()
+    catalog = pd.read_csv(os.path.join(input_dir, 'EvidenceCatalog.csv'))
+    catalog['STUDYSOP'] = munge.apply_rules(catalog, 'STUDYSOP', munge.STUDYSOP_RULES)
+    for field in munge.MISSINGNESS_FIELDS:
+        rows = report[report['DateField'] == field].set_index('STUDYSOP')
+        populated = catalog[field].notna().groupby(catalog['STUDYSOP'], dropna=False).sum()
+        assert rows['PopulatedCount'].sort_index().to_dict() == populated.sort_index().to_dict()
+        assert (rows['PopulatedCount'] + rows['MissingnessCount']).sum() == len(catalog)
+
+
+def test_missingness_chunks_add_up_to_one_pass(input_dir):
+    catalog = munge.read_catalog(os.path.join(input_dir, 'EvidenceCatalog.csv'), missingness=munge.MissingnessProfile())
+    catalog['STUDYSOP'] = munge.apply_rules(catalog, 'STUDYSOP', munge.STUDYSOP_RULES)
+    whole = munge.MissingnessProfile()
+    whole.add(catalog)
+    chunked = munge.MissingnessProfile()
+    for start in range(0, len(catalog), 100):
+        chunked.add(catalog.iloc[start:start + 100])
+    pd.testing.assert_frame_equal(chunked.report(), whole.report())
+
+
+def test_catalog_columns_follow_rule_tables(tmp_path, monkeypatch):
+    path = tmp_path / 'EvidenceCatalog.csv'
+    path.write_text('NAME,NEWFLAG,UNUSED,STUDYSOP,FSFV\n')
+    monkeypatch.setattr(munge, 'STUDYSOP_RULES', munge.STUDYSOP_RULES + [('NEWFLAG', '==', 'Y', 'CT45')])
+    assert munge.catalog_columns(str(path)) == ['NAME', 'NEWFLAG', 'STUDYSOP']
+    assert munge.catalog_columns(str(path), missingness=munge.MissingnessProfile(['FSFV']))[-1] == 'FSFV'
+    assert munge.catalog_columns(str(path), subset_columns=False) is None
+
+
+def sorted_rows(frame):
+    return sorted(frame.astype(object).to_csv(index=False, header=False).splitlines())
+
+
+@pytest.mark.parametrize('chunksize', [None, 40])
+def test_parquet_extracts_read_back_as_the_csv_rows(input_dir, tmp_path, chunksize):
+    pytest.importorskip('pyarrow')
+    csv_dir = str(tmp_path / 'csv')
+    build(input_dir, csv_dir)
+    parquet_dir = str(tmp_path / 'parquet')
+    os.makedirs(parquet_dir)
+    shape = munge.write_dashboard_outputs(input_dir, parquet_dir, chunksize=chunksize, output_format='parquet')
+    assert shape == pd.read_csv(os.path.join(csv_dir, 'nis.csv')).shape
+
+    for name, columns in (('nis', ['NAME', 'TITLE', 'APPROVED_AMOUNT']),
+                          ('study_countries', ['NAME', 'COUNTRY', 'Numeric'])):
+        path = os.path.join(parquet_dir, name)
+        expected_rows = pd.read_csv(os.path.join(csv_dir, name + '.csv'), dtype=str)
+        assert sorted_rows(munge.read_partitioned(path)[expected_rows.columns]) == sorted_rows(expected_rows)
+
+        selected = expected_rows[(expected_rows['STUDYSOP'] == 'CT24')
+                                 & expected_rows['STATUS'].isin(['Ongoing', 'Completed'])]
+        assert len(selected)
+        subset = munge.read_partitioned(path, columns, STUDYSOP='CT24', STATUS=['Ongoing', 'Completed'])
+        assert list(subset.columns) == columns
+        assert sorted_rows(subset) == sorted_rows(selected[columns])
+
+        # One file per partition, however many chunks were written.
+        files = [file for _, _, files in os.walk(path) for file in files]
+        assert len(files) == len(expected_rows[['STUDYSOP', 'STATUS']].drop_duplicates())
+    assert not any(entry.endswith('.chunks') for entry in os.listdir(parquet_dir))
+
+
+def test_partitioned_chunks_keep_missing_partition_values(tmp_path):
+    pytest.importorskip('pyarrow')
+    chunks = str(tmp_path / 'extract.chunks')
+    first = pd.DataFrame({'NAME': ['A1', 'A2', 'A3'], 'NOTE': [None, None, None], 'AMOUNT': [1.0, np.nan, 3.0],
+                          'STUDYSOP': ['CT24', np.nan, 'CT24'], 'STATUS': ['Ongoing', 'Ongoing', np.nan]})
+    second = pd.DataFrame({'NAME': ['A4', 'A5'], 'NOTE': ['x', None], 'AMOUNT': [4.0, 5.0],
+                           'STUDYSOP': [np.nan, 'CT24'], 'STATUS': ['Ongoing', 'Ongoing']})
+    for number, frame in enumerate([first, second]):
+        munge.write_partitioned(frame, chunks, basename_template='chunk-{:08d}-{{i}}.parquet'.format(number))
+    path = str(tmp_path / 'extract')
+    munge._compact_partitioned(chunks, path)
+
+    extract = munge.read_partitioned(path).set_index('NAME').sort_index()
+    assert extract['STUDYSOP'].isna().tolist() == [False, True, False, True, False]
+    assert extract['STATUS'].isna().tolist() == [False, False, True, False, False]
+    assert extract.loc['A4', 'NOTE'] == 'x'
+    assert extract.loc[['A1', 'A3', 'A4', 'A5'], 'AMOUNT'].tolist() == [1.0, 3.0, 4.0, 5.0]
+    assert np.isnan(extract.loc['A2', 'AMOUNT'])
+    # Rows stay in the order they were written within each partition.
+    ongoing = munge.read_partitioned(path, ['NAME'], STUDYSOP='CT24', STATUS='Ongoing')
+    assert ongoing['NAME'].astype(object).tolist() == ['A1', 'A5']